@@ -8,25 +8,34 @@ import io
 import socket
 import gc
 import json
+import importlib.util
 from datetime import datetime, timedelta
 
 from telegram import Update, Message, Bot, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, MenuButtonWebApp, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, UserProfilePhotos, File, ChatMemberUpdated, ChatMember, Dice, InputMediaPhoto, InputMediaVideo, InputMediaAudio, InputMediaDocument, BotCommand
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, Forbidden
 from telegram.ext import Application, ContextTypes, CommandHandler, filters, MessageHandler
+from telegram.request import HTTPXRequest
 
 from user_details import (
-    load_banned, save_banned, load_users, save_users,
-    load_user_details, save_user_details, get_user_data,
-    update_user_data_field, get_user_info_string, get_user_id_by_topic_id,
+    load_banned, load_users, get_user_data,
+    update_user_data, update_user_data_field, get_user_info_string, get_user_id_by_topic_id,
     add_to_banned, remove_from_banned, is_banned,
-    add_to_users, remove_from_users, is_user
+    add_to_users, remove_from_users, is_user,
+    set_storage_engine, has_pending_writes, collect_pending_writes,
+    write_pending_writes, requeue_pending_writes, flush_pending_writes,
+    get_externally_modified_stores, reload_stores
 )
 
 from config_manager import ConfigManager
+from message_links import MessageLinkStore
 import reactions
 import message_edit_handler
 import debug
+import update_context
+import broadcast
+import outbound
+from update_context import get_identity
 
 def message_to_telegram_dict(message):
     result = {}
@@ -59,11 +68,9 @@ import roles
 import delete_handler
 
 send_states = {}
-publish_state = {"active": False, "content": None, "pin": False}
+publish_state = {"active": False, "content": None, "pin": False, "send_at": None}
+CAMPAIGN_POLL_INTERVAL = 5
 send_receipt = True
-send_to_admin_queue = asyncio.Queue()
-admin_to_user_queue = asyncio.Queue()
-message_status_queue = asyncio.Queue()
 admin_id = None
 sync_message_counter = 0
 topic_mode_group_id = None
@@ -72,8 +79,15 @@ user_last_message = {}
 config_mngr = None
 stop_telegram_bot_event = threading.Event()
 off_command_confirmation_code = None
-message_links = {}
+message_links = MessageLinkStore()
 _last_pinned_messages = {}
+_pending_confirmations = {}
+_recall_tasks = set()
+_media_groups = {}
+MEDIA_GROUP_DELAY = 1.0
+_last_confirmations = {}
+CONFIRMATION_DELAY = 1.5
+CONFIRMATION_EDIT_WINDOW = 30
 subscribers = set()
 bot_paused = False
 
@@ -82,55 +96,42 @@ _restart_lock = threading.Lock()
 
 
 def get_user_message_for_admin_message(admin_chat_id, admin_message_id):
-    admin_key = f"{admin_chat_id}:{admin_message_id}"
+    link = message_links.get_by_admin(admin_chat_id, admin_message_id)
     
-    if admin_key in message_links:
-        link_data = message_links[admin_key]
-        return link_data.get('user_id'), link_data.get('user_message_id'), link_data.get('is_from_user', True)
-    
-    for key, data in message_links.items():
-        if data.get('admin_message_id') == admin_message_id and data.get('admin_chat_id') == admin_chat_id:
-            return data.get('user_id'), data.get('user_message_id'), data.get('is_from_user', True)
+    if link:
+        return link.user_id, link.user_message_id, link.is_from_user
     
     return None, None, None
 
 
-def save_message_link(user_id, user_message_id, admin_chat_id, admin_message_id, is_from_user=True):
-    global message_links
-    
-    user_key = f"{user_id}:{user_message_id}"
-    admin_key = f"{admin_chat_id}:{admin_message_id}"
-    message_links[user_key] = {
-        'admin_chat_id': admin_chat_id,
-        'admin_message_id': admin_message_id,
-        'is_from_user': is_from_user,
-        'timestamp': time.time()
-    }
-    
-    message_links[admin_key] = {
-        'user_id': user_id,
-        'user_message_id': user_message_id,
-        'is_from_user': is_from_user,
-        'timestamp': time.time()
-    }
+def save_message_link(user_id, user_message_id, admin_chat_id, admin_message_id, is_from_user=True, topic_id=None):
+    message_links.save(
+        user_id,
+        user_message_id,
+        admin_chat_id,
+        admin_message_id,
+        is_from_user=is_from_user,
+        topic_id=topic_id
+    )
 
 
 def get_admin_message_for_user_message(user_id, user_message_id):
-    global message_links
+    link = message_links.get_by_user(user_id, user_message_id)
     
-    user_key = f"{user_id}:{user_message_id}"
-    
-    if user_key in message_links:
-        info = message_links[user_key]
-        return info['admin_chat_id'], info['admin_message_id'], info.get('is_from_user', False)
+    if link:
+        return link.admin_chat_id, link.admin_message_id, link.is_from_user
     
     return None, None, False
 
 
 async def get_effective_user_details(user_id, update: Update = None, context: ContextTypes.DEFAULT_TYPE = None):
     user_id_str = str(user_id)
-    all_details = load_user_details()
-    user_data = all_details.get(user_id_str, {})
+    identity = get_identity(update, context) if update else None
+    if identity is not None and str(identity.user_id) == user_id_str:
+        stored_user_data = identity.user_data
+    else:
+        stored_user_data = get_user_data(user_id_str)
+    user_data = stored_user_data if stored_user_data is not None else {}
 
     effective_user_obj = None
     if update and update.effective_user and str(update.effective_user.id) == user_id_str:
@@ -138,25 +139,23 @@ async def get_effective_user_details(user_id, update: Update = None, context: Co
     elif context and 'effective_user_cache' in context.bot_data and user_id_str in context.bot_data['effective_user_cache']:
          effective_user_obj = context.bot_data['effective_user_cache'][user_id_str]
 
-    needs_save = False
-    if user_id_str not in all_details:
-        all_details[user_id_str] = user_data
-        needs_save = True
+    needs_save = stored_user_data is None
+    changed_fields = {}
 
     if effective_user_obj:
         current_username = effective_user_obj.username
         current_full_name = f"{effective_user_obj.first_name or ''} {effective_user_obj.last_name or ''}".strip()
 
         if user_data.get("telegram_username") != current_username:
-            user_data["telegram_username"] = current_username
+            changed_fields["telegram_username"] = current_username
             needs_save = True
         if user_data.get("full_name") != current_full_name:
-            user_data["full_name"] = current_full_name
+            changed_fields["full_name"] = current_full_name
             needs_save = True
 
         if needs_save:
-            all_details[user_id_str] = user_data
-            save_user_details(all_details)
+            update_user_data(user_id_str, changed_fields)
+            user_data = get_user_data(user_id_str) or user_data
 
     if update and update.effective_user:
         if 'effective_user_cache' not in context.bot_data:
@@ -176,32 +175,28 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await get_effective_user_details(user_id_str, update, context)
 
-    banned_users = load_banned()
-    if user_id_str in banned_users:
+    identity = get_identity(update, context)
+    if identity.is_banned:
         await update.message.reply_text("You are banned and cannot use this bot.")
         return
 
-    users_list_for_publish = load_users()
-    if user_id_str not in users_list_for_publish:
-        users_list_for_publish.add(user_id_str)
-        save_users(users_list_for_publish)
-    
-    from roles import is_admin, is_operator
+    if not identity.is_subscribed:
+        add_to_users(user_id_str)
     
-    if is_admin(user.id):
+    if identity.is_admin:
         admin_display_name = user.first_name
         if user.username:
             admin_display_name = f"{user.first_name} (@{user.username})" if user.first_name else f"@{user.username}"
         elif not user.first_name:
             admin_display_name = "Administrator"
 
-        help_message_admin = f"{admin_display_name}, welcome!\n\nMain Commands:\n/ban <userid> - Ban a user.\n/unban <userid> - Unban a user.\n/publish (pin) - Start broadcasting a message to all subscribers.\n/cooldown <seconds> - Set anti-spam timer (0 to disable).\n/mode <group_id|off> - Set topic mode with a group or disable it.\n/whois <userid> - Get detailed information about a user.\n/pause - Temporarily disable bot for users (admin commands still work).\n/resume - Resume normal bot operation after pause.\n/update - Restart the bot (applies code changes).\n/off - Emergency shutdown (requires confirmation).\n/cancel - Cancel current multi-step operation.\n\nMessage Management:\n/pin - Pin a message (reply to message in a user topic).\n/unpin - Unpin a message (reply to message in a user topic).\n/delete - Delete a message from both admin and user chats.\n/reactions - Show reaction statistics for messages.\n\nDebugging:\n/debug on - Enable debug mode (forward all messages to you).\n/debug off - Disable debug mode.\n/debug <chat_id> - Forward all messages to specified chat.\n\nGeneral Commands (also available to users):\n/help - This help message.\n/start - Initial greeting/help.\n/subscribe - Subscribe to mass mailings.\n/unsubscribe - Unsubscribe from mass mailings.\n/hide - Toggle message delivery confirmations.\n\nAuthor: @yetazero"
+        help_message_admin = f"{admin_display_name}, welcome!\n\nMain Commands:\n/ban <userid> - Ban a user.\n/unban <userid> - Unban a user.\n/publish (pin) (in 30m|at 18:30) - Queue a broadcast to all subscribers, optionally scheduled.\n/campaigns - List queued broadcasts (/campaigns cancel <id>).\n/unpublish <id> - Delete a sent broadcast from all chats.\n/cooldown <seconds> - Set anti-spam timer (0 to disable).\n/mode <group_id|off> - Set topic mode with a group or disable it.\n/whois <userid> - Get detailed information about a user.\n/pause - Temporarily disable bot for users (admin commands still work).\n/resume - Resume normal bot operation after pause.\n/update - Restart the bot (applies code changes).\n/off - Emergency shutdown (requires confirmation).\n/cancel - Cancel current multi-step operation.\n\nMessage Management:\n/pin - Pin a message (reply to message in a user topic).\n/unpin - Unpin a message (reply to message in a user topic).\n/delete - Delete a message from both admin and user chats.\n/reactions - Show reaction statistics for messages.\n/apistats - Show Bot API call and error statistics (/apistats reset).\n\nDebugging:\n/debug on - Enable debug mode (forward all messages to you).\n/debug off - Disable debug mode.\n/debug <chat_id> - Forward all messages to specified chat.\n\nGeneral Commands (also available to users):\n/help - This help message.\n/start - Initial greeting/help.\n/subscribe - Subscribe to mass mailings.\n/unsubscribe - Unsubscribe from mass mailings.\n/hide - Toggle message delivery confirmations.\n\nAuthor: @yetazero"
         
         try:
             await update.message.reply_text(help_message_admin)
         except Exception as e:
             await update.message.reply_text(f"Error displaying help: {str(e)}")
-    elif is_operator(user.id):
+    elif identity.is_operator:
         operator_display_name = user.first_name
         if user.username:
             operator_display_name = f"{user.first_name} (@{user.username})" if user.first_name else f"@{user.username}"
@@ -256,8 +251,6 @@ async def whois_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 has_arg = True
 
     if target_user_id and has_arg:
-        all_details = load_user_details()
-        
         try:
             target_user_obj = None
             target_user_int_id = int(target_user_id)
@@ -272,7 +265,7 @@ async def whois_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     print(f"Could not get user info for {target_user_id}: {e}")
                     pass
             
-            user_info = get_user_info_string(target_user_id, all_details.get(str(target_user_id), {}), target_user_obj)
+            user_info = get_user_info_string(target_user_id, effective_user_obj=target_user_obj)
             
             user_photo = None
             if target_user_obj and hasattr(target_user_obj, 'photo') and target_user_obj.photo:
@@ -293,7 +286,7 @@ async def whois_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 await update.message.reply_text(user_info, parse_mode=ParseMode.MARKDOWN)
         except Exception as e:
-            user_info = get_user_info_string(target_user_id, all_details.get(str(target_user_id), {}))
+            user_info = get_user_info_string(target_user_id)
             await update.message.reply_text(f"{user_info}\n\n🔹 Error getting additional info: {str(e)}", parse_mode=ParseMode.MARKDOWN)
     else:
         await update.message.reply_text(
@@ -301,6 +294,223 @@ async def whois_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+def _delivery_confirmation_text(count):
+    if count == 1:
+        return "Message has been delivered. /hide to hide system notifications."
+    return f"{count} messages have been delivered. /hide to hide system notifications."
+
+
+def schedule_delivery_confirmation(context, message):
+    """Debounces delivery confirmations so a burst of messages from one user gets a single receipt"""
+    chat_id = message.chat_id
+    pending = _pending_confirmations.get(chat_id)
+    due = time.monotonic() + CONFIRMATION_DELAY
+    if pending:
+        pending['count'] += 1
+        pending['reply_to'] = message.message_id
+        pending['due'] = due
+        return
+
+    _pending_confirmations[chat_id] = {'count': 1, 'reply_to': message.message_id, 'due': due}
+    if len(_last_confirmations) > 1000:
+        now = time.monotonic()
+        for stale_chat_id in [cid for cid, last in _last_confirmations.items() if now - last['timestamp'] >= CONFIRMATION_EDIT_WINDOW]:
+            del _last_confirmations[stale_chat_id]
+    context.application.create_task(send_delivery_confirmation(context.bot, chat_id))
+
+
+async def send_delivery_confirmation(bot, chat_id):
+    pending = _pending_confirmations[chat_id]
+    while (delay := pending['due'] - time.monotonic()) > 0:
+        await asyncio.sleep(delay)
+    del _pending_confirmations[chat_id]
+
+    with outbound.priority(outbound.PRIORITY_CONFIRMATION):
+        last = _last_confirmations.get(chat_id)
+        if last and time.monotonic() - last['timestamp'] < CONFIRMATION_EDIT_WINDOW:
+            count = last['count'] + pending['count']
+            try:
+                await bot.edit_message_text(_delivery_confirmation_text(count), chat_id=chat_id, message_id=last['message_id'])
+                _last_confirmations[chat_id] = {'message_id': last['message_id'], 'count': count, 'timestamp': time.monotonic()}
+                return
+            except Exception:
+                pass
+
+        try:
+            sent = await bot.send_message(
+                chat_id,
+                _delivery_confirmation_text(pending['count']),
+                reply_to_message_id=pending['reply_to'],
+                allow_sending_without_reply=True
+            )
+            _last_confirmations[chat_id] = {'message_id': sent.message_id, 'count': pending['count'], 'timestamp': time.monotonic()}
+        except Exception:
+            pass
+
+
+async def get_or_create_user_topic(context, user, message):
+    """Returns the forum topic of a user in topic mode, creating it on first contact; None if that failed"""
+    user_id_str = str(user.id)
+    topic_id = None
+    
+    user_data = get_user_data(user_id_str) or {}
+    
+    if user_data and "topic_id_in_group" in user_data:
+        topic_id = user_data["topic_id_in_group"]
+    
+    if not topic_id:
+        topic_title = "User " + user_id_str
+        if user.username:
+            topic_title = f"@{user.username}"
+        if user.first_name:
+            topic_title = user.first_name
+            if user.last_name:
+                topic_title += f" {user.last_name}"
+        
+        try:
+            new_topic = await context.bot.create_forum_topic(chat_id=topic_mode_group_id, name=topic_title)
+            topic_id = new_topic.message_thread_id
+            
+            update_user_data_field(user_id_str, "topic_id_in_group", topic_id)
+        except Forbidden as e:
+            await message.reply_text("Error: Bot does not have permission to create topics. Administrator needs to check bot permissions in the group.")
+            await context.bot.send_message(admin_id, f"CRITICAL: Forbidden to create topic for User {user_id_str} (Name: {topic_title}) in group {topic_mode_group_id}. Check bot permissions (Manage Topics). Error: {e}")
+            return None
+        except BadRequest as e:
+            await message.reply_text("Error: Could not create communication channel. Perhaps the group is not a forum or another problem occurred. Inform the administrator.")
+            await context.bot.send_message(admin_id, f"CRITICAL: BadRequest error creating topic for User {user_id_str} (Name: {topic_title}) in group {topic_mode_group_id}. Is this a forum? Error: {e}")
+            return None
+        except Exception as e:
+            await message.reply_text("Unexpected error creating communication channel. Please try again later.")
+            await context.bot.send_message(admin_id, f"CRITICAL: Unexpected error creating topic for User {user_id_str} (Name: {topic_title}). Error: {e}")
+            return None
+    
+    return topic_id
+
+
+def add_to_media_group(message):
+    """Adds an album item to an album already being buffered; returns False if it starts a new album"""
+    media_group = _media_groups.get((message.chat_id, message.media_group_id))
+    if media_group is None:
+        return False
+    media_group['messages'].append(message)
+    media_group['due'] = time.monotonic() + MEDIA_GROUP_DELAY
+    return True
+
+
+def start_media_group(context, user, message, user_data):
+    """Buffers the first item of an album; the whole album is relayed once no new item came for MEDIA_GROUP_DELAY"""
+    key = (message.chat_id, message.media_group_id)
+    _media_groups[key] = {'messages': [message], 'due': time.monotonic() + MEDIA_GROUP_DELAY}
+    context.application.create_task(relay_media_group(context, user, key, user_data))
+
+
+def album_input_media(messages):
+    """Builds send_media_group items that resend an album by file id; None if an item has no album media"""
+    media = []
+    for item in messages:
+        caption = {'caption': item.caption, 'caption_entities': item.caption_entities}
+        if item.photo:
+            media.append(InputMediaPhoto(item.photo[-1].file_id, has_spoiler=item.has_media_spoiler, **caption))
+        elif item.video:
+            media.append(InputMediaVideo(item.video.file_id, has_spoiler=item.has_media_spoiler, **caption))
+        elif item.document:
+            media.append(InputMediaDocument(item.document.file_id, **caption))
+        elif item.audio:
+            media.append(InputMediaAudio(item.audio.file_id, **caption))
+        else:
+            return None
+    return media
+
+
+async def relay_media_group(context, user, key, user_data):
+    media_group = _media_groups[key]
+    while (delay := media_group['due'] - time.monotonic()) > 0:
+        await asyncio.sleep(delay)
+    del _media_groups[key]
+
+    messages = sorted(media_group['messages'], key=lambda item: item.message_id)
+    first_message = messages[0]
+    user_id_str = str(user.id)
+
+    reply_message = next((item.reply_to_message for item in messages if item.reply_to_message), None)
+    reply_info = ""
+    replied_to_admin_message_id = None
+    if reply_message:
+        admin_chat_id, admin_msg_id, is_from_user = get_admin_message_for_user_message(
+            int(user_id_str), reply_message.message_id
+        )
+        if admin_chat_id and admin_msg_id:
+            replied_to_admin_message_id = admin_msg_id
+            reply_info = "\n\n[This is a reply to a message]" if is_topic_mode_active() else "\n\n[This is a reply to an admin message]"
+        else:
+            reply_info = "\n\n[User replied to their own message]"
+
+    if is_topic_mode_active():
+        topic_id = await get_or_create_user_topic(context, user, first_message)
+        if not topic_id:
+            return
+        target_chat_id = topic_mode_group_id
+    else:
+        topic_id = None
+        target_chat_id = admin_id
+
+    try:
+        # copy_messages cannot reply, so an album answering a linked message is resent by file id instead
+        reply_media = album_input_media(messages) if topic_id and replied_to_admin_message_id else None
+        if reply_media:
+            copied_ids = await context.bot.send_media_group(
+                chat_id=target_chat_id,
+                media=reply_media,
+                message_thread_id=topic_id,
+                reply_to_message_id=replied_to_admin_message_id
+            )
+        else:
+            copied_ids = await context.bot.copy_messages(
+                chat_id=target_chat_id,
+                from_chat_id=first_message.chat_id,
+                message_ids=[item.message_id for item in messages],
+                message_thread_id=topic_id
+            )
+
+        if topic_id:
+            if reply_info and not reply_media:
+                await context.bot.send_message(
+                    chat_id=target_chat_id,
+                    message_thread_id=topic_id,
+                    text=reply_info,
+                    reply_to_message_id=copied_ids[0].message_id
+                )
+        else:
+            user_info_md = get_user_info_string(user_id_str, effective_user_obj=user)
+            await context.bot.send_message(
+                target_chat_id,
+                f"Message from:\n{user_info_md}{reply_info}\n\nAlbum of {len(messages)} items",
+                parse_mode=ParseMode.MARKDOWN,
+                reply_to_message_id=copied_ids[0].message_id,
+                disable_notification=True
+            )
+
+        for item, copied_id in zip(messages, copied_ids if len(copied_ids) == len(messages) else ()):
+            save_message_link(
+                user_id=int(user_id_str),
+                user_message_id=item.message_id,
+                admin_chat_id=target_chat_id,
+                admin_message_id=copied_id.message_id,
+                is_from_user=True,
+                topic_id=topic_id
+            )
+
+        if not user_data.get("hide_delivery_notifications", False):
+            for item in messages:
+                schedule_delivery_confirmation(context, item)
+    except Exception as e:
+        try:
+            await first_message.reply_text("An error occurred while sending your album.")
+        except Exception as e_reply:
+            pass
+
+
 async def forward_to_admin_or_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global bot_paused, topic_mode_group_id, admin_id
     if bot_paused:
@@ -310,11 +520,17 @@ async def forward_to_admin_or_topic(update: Update, context: ContextTypes.DEFAUL
     user_id_str = str(user.id)
     message = update.message
 
-    from roles import has_role
-    if has_role(user_id_str):
+    identity = get_identity(update, context)
+    if identity.has_role:
         return
 
-    if user_id_str in load_banned(): return
+    if identity.is_banned: return
+
+    broadcast.yield_to_live_traffic()
+
+    is_album_item = bool(message.media_group_id) and message.chat_id == user.id
+    if is_album_item and add_to_media_group(message):
+        return
 
     user_current_data = await get_effective_user_details(user_id_str, update, context)
 
@@ -360,54 +576,24 @@ async def forward_to_admin_or_topic(update: Update, context: ContextTypes.DEFAUL
                     user_message_id=sent_msg.message_id,
                     admin_chat_id=message.chat_id,
                     admin_message_id=message.message_id,
-                    is_from_user=False
+                    is_from_user=False,
+                    topic_id=topic_id
                 )
                 
                 return
             except Exception as e:
                 print(f"Error relaying message to topic owner: {e}")
 
+    if is_album_item:
+        start_media_group(context, user, message, user_current_data)
+        return
+
     bot_sent_message = None 
 
     if is_topic_mode_active():
-        topic_id = None
-        
-        all_user_details = load_user_details()
-        user_data = all_user_details.get(user_id_str, {})
-        
-        if user_data and "topic_id_in_group" in user_data:
-            topic_id = user_data["topic_id_in_group"]
-        
+        topic_id = await get_or_create_user_topic(context, user, message)
         if not topic_id:
-            topic_title = "User " + user_id_str
-            if user.username:
-                topic_title = f"@{user.username}"
-            if user.first_name:
-                topic_title = user.first_name
-                if user.last_name:
-                    topic_title += f" {user.last_name}"
-            
-            try:
-                new_topic = await context.bot.create_forum_topic(chat_id=topic_mode_group_id, name=topic_title)
-                topic_id = new_topic.message_thread_id
-                
-                all_user_details = load_user_details()
-                if user_id_str not in all_user_details:
-                    all_user_details[user_id_str] = {}
-                all_user_details[user_id_str]["topic_id_in_group"] = topic_id
-                save_user_details(all_user_details)
-            except Forbidden as e:
-                await message.reply_text("Error: Bot does not have permission to create topics. Administrator needs to check bot permissions in the group.")
-                await context.bot.send_message(admin_id, f"CRITICAL: Forbidden to create topic for User {user_id_str} (Name: {topic_title}) in group {topic_mode_group_id}. Check bot permissions (Manage Topics). Error: {e}")
-                return
-            except BadRequest as e:
-                await message.reply_text("Error: Could not create communication channel. Perhaps the group is not a forum or another problem occurred. Inform the administrator.")
-                await context.bot.send_message(admin_id, f"CRITICAL: BadRequest error creating topic for User {user_id_str} (Name: {topic_title}) in group {topic_mode_group_id}. Is this a forum? Error: {e}")
-                return
-            except Exception as e:
-                await message.reply_text("Unexpected error creating communication channel. Please try again later.")
-                await context.bot.send_message(admin_id, f"CRITICAL: Unexpected error creating topic for User {user_id_str} (Name: {topic_title}). Error: {e}")
-                return
+            return
         
         try: 
             reply_info = ""
@@ -447,7 +633,8 @@ async def forward_to_admin_or_topic(update: Update, context: ContextTypes.DEFAUL
                 user_message_id=message.message_id,
                 admin_chat_id=topic_mode_group_id,
                 admin_message_id=bot_sent_message.message_id,
-                is_from_user=True
+                is_from_user=True,
+                topic_id=topic_id
             )
             if message.dice:
                 await context.bot.send_message(
@@ -457,12 +644,8 @@ async def forward_to_admin_or_topic(update: Update, context: ContextTypes.DEFAUL
                     disable_notification=True
                 )
 
-            user_settings = get_user_data(user_id_str)
-            if not (user_settings and user_settings.get("hide_delivery_notifications", False)):
-                try:
-                    await update.message.reply_text("Message has been delivered. /hide to hide system notifications.")
-                except Exception as notify_e:
-                    pass
+            if not user_current_data.get("hide_delivery_notifications", False):
+                schedule_delivery_confirmation(context, update.message)
         except BadRequest as e:
             await message.reply_text("Error with your designated topic. Please inform the administrator. Your message was not delivered to the topic.")
         except Forbidden as e:
@@ -472,7 +655,7 @@ async def forward_to_admin_or_topic(update: Update, context: ContextTypes.DEFAUL
     
     else: 
 
-        user_info_md = get_user_info_string(user_id_str, user_current_data, effective_user_obj=user) 
+        user_info_md = get_user_info_string(user_id_str, effective_user_obj=user) 
         header_text_for_admin = f"Message from:\n{user_info_md}"
         
         reply_info = ""
@@ -526,12 +709,8 @@ async def forward_to_admin_or_topic(update: Update, context: ContextTypes.DEFAUL
                          disable_notification=True 
                      )
             
-            user_settings = get_user_data(user_id_str)
-            if not (user_settings and user_settings.get("hide_delivery_notifications", False)):
-                try:
-                    await update.message.reply_text("Message has been delivered. /hide to hide system notifications.")
-                except Exception as notify_e:
-                    pass
+            if not user_current_data.get("hide_delivery_notifications", False):
+                schedule_delivery_confirmation(context, update.message)
 
         except Exception as e:
             try:
@@ -539,7 +718,7 @@ async def forward_to_admin_or_topic(update: Update, context: ContextTypes.DEFAUL
             except Exception as e_reply:
                  pass
 
-    if bot_sent_message: 
+    if bot_sent_message and not is_topic_mode_active(): 
         if 'message_mappings' not in context.bot_data:
             context.bot_data['message_mappings'] = {}
         
@@ -557,6 +736,8 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     if not is_admin(update.effective_user.id):
         return
 
+    broadcast.yield_to_live_traffic()
+
     message = update.message
 
     global publish_state
@@ -653,14 +834,13 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     message_content = None
                     
                     debug_info.append(f"Trying to find pinned message directly: ID {pinned_msg.message_id}")
-                    admin_key = f"{message.chat_id}:{pinned_msg.message_id}"
-                    if admin_key in message_links:
-                        info = message_links[admin_key]
-                        user_id_from_key = info.get('user_id')
-                        user_msg_id_from_key = info.get('user_message_id')
+                    info = message_links.get_by_admin(message.chat_id, pinned_msg.message_id)
+                    if info:
+                        user_id_from_key = info.user_id
+                        user_msg_id_from_key = info.user_message_id
                         if user_id_from_key == target_user_int_id and user_msg_id_from_key:
                             message_to_pin_id = user_msg_id_from_key
-                            is_from_user = info.get('is_from_user', False)
+                            is_from_user = info.is_from_user
                             debug_info.append(f"Found direct mapping for pinned message: {message_to_pin_id} (from user: {is_from_user})")
                     
                     if not message_to_pin_id:
@@ -669,20 +849,12 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
                             pinned_text = pinned_msg.text
                             debug_info.append(f"Using text matching for: '{pinned_text[:20]}...'")
                         
-                        bot_messages = []
-                        
-                        for key, mapping in message_links.items():
-                            if mapping.get('user_id') == target_user_int_id and \
-                               mapping.get('user_message_id') and \
-                               not mapping.get('is_from_user', True):
-                                bot_messages.append((mapping.get('timestamp', 0), mapping.get('user_message_id')))
+                        debug_info.append(f"Found {message_links.outbound_count(target_user_int_id)} bot messages for this user")
                         
-                        debug_info.append(f"Found {len(bot_messages)} bot messages for this user")
+                        latest_bot_message = message_links.latest_outbound(target_user_int_id)
                         
-                        bot_messages.sort(reverse=True)
-                        
-                        if bot_messages:
-                            message_to_pin_id = bot_messages[0][1]
+                        if latest_bot_message:
+                            message_to_pin_id = latest_bot_message.user_message_id
                             debug_info.append(f"Found recent bot message to pin: {message_to_pin_id}")
                     
                     if hasattr(pinned_msg, 'text') and pinned_msg.text:
@@ -759,7 +931,8 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 sent_message.message_id,
                 message.chat_id,
                 message.message_id,
-                is_from_user=False
+                is_from_user=False,
+                topic_id=message.message_thread_id
             )
             return
     
@@ -943,103 +1116,255 @@ async def send_content_to_user(bot, target_user_id, content_dict, reply_to_messa
 
 
 async def process_publishing(message, bot, content_to_broadcast_msg_obj: Message):
-    sent_count = 0
-    failed_count = 0
-    pin_count = 0
-    pin_failed = 0
     should_pin = publish_state.get("pin", False)
-    pin_message_ids = {}
-    
-    users_to_publish = load_users()
-    banned = load_banned()
-
-    attempt_users_list = [uid for uid in users_to_publish if uid not in banned]
-    total_users_to_try = len(attempt_users_list)
+    send_at = publish_state.get("send_at")
 
     if not content_to_broadcast_msg_obj:
         await message.reply_text("Error: No content found to publish. Please try /publish again.")
-        publish_state["active"] = False
-        publish_state["content"] = None
-        publish_state["pin"] = False
+        _reset_publish_state()
         return
 
-    if total_users_to_try == 0:
-        await message.reply_text("No users to publish to (all subscribed users are banned or list is empty).")
-        publish_state["active"] = False
-        publish_state["content"] = None
-        publish_state["pin"] = False
-        return
+    job = broadcast.BroadcastJob.create(
+        bot,
+        content_to_broadcast_msg_obj.chat.id,
+        content_to_broadcast_msg_obj.message_id,
+        pin=should_pin,
+        status_chat_id=message.chat_id,
+        scheduled_at=send_at
+    )
+    broadcast.campaigns.add(job)
+    _reset_publish_state()
 
     pin_text = " with PIN" if should_pin else ""
-    status_msg = await message.reply_text(f"Publishing{pin_text} to {total_users_to_try} users...")
-    processed_count = 0
-    
-    from_chat_id_for_copy = content_to_broadcast_msg_obj.chat.id
-    message_id_for_copy = content_to_broadcast_msg_obj.message_id
+    if send_at:
+        start_text = f"starts at {datetime.fromtimestamp(send_at).strftime('%Y-%m-%d %H:%M')}"
+    elif broadcast.campaigns.running is not None:
+        start_text = "starts after the running campaign"
+    else:
+        start_text = "starts now"
+    await message.reply_text(f"Campaign {job.job_id}{pin_text} queued, {start_text}. /campaigns to view or cancel.")
 
-    for user_id_str in attempt_users_list:
-        processed_count += 1
+
+def _reset_publish_state():
+    publish_state["active"] = False
+    publish_state["content"] = None
+    publish_state["pin"] = False
+    publish_state["send_at"] = None
+
+
+def _parse_publish_schedule(args):
+    """Parses /publish arguments: [pin] [in <N>m|<N>h | at HH:MM | at YYYY-MM-DD HH:MM]"""
+    args = [arg.lower() for arg in args or []]
+    pin = False
+    if args and args[0] == "pin":
+        pin = True
+        args = args[1:]
+    if not args:
+        return pin, None
+
+    if args[0] == "in" and len(args) == 2:
+        match = re.fullmatch(r"(\d+)([mh]?)", args[1])
+        if not match:
+            raise ValueError("Use a delay like 30m or 2h.")
+        amount = int(match.group(1))
+        seconds = amount * 3600 if match.group(2) == "h" else amount * 60
+        return pin, time.time() + seconds
+
+    if args[0] == "at" and len(args) in (2, 3):
+        now = datetime.now()
         try:
-            sent_message = await bot.copy_message(
-                chat_id=int(user_id_str),
-                from_chat_id=from_chat_id_for_copy,
-                message_id=message_id_for_copy
-            )
-            sent_count += 1
-            
-            if should_pin and sent_message:
-                pin_message_ids[user_id_str] = sent_message.message_id
-                
-        except Forbidden:
-            failed_count += 1
-        except BadRequest as e: 
-            failed_count += 1
-        except Exception as e:
-            failed_count += 1
+            if len(args) == 3:
+                send_at = datetime.strptime(f"{args[1]} {args[2]}", "%Y-%m-%d %H:%M")
+            else:
+                clock = datetime.strptime(args[1], "%H:%M")
+                send_at = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+                if send_at <= now:
+                    send_at += timedelta(days=1)
+        except ValueError:
+            raise ValueError("Use a time like 18:30 or 2025-01-31 18:30.")
+        return pin, send_at.timestamp()
 
-        if processed_count % 10 == 0 or processed_count == total_users_to_try: 
-            try:
-                await status_msg.edit_text(f"Publishing{pin_text}: {processed_count}/{total_users_to_try} processed, {sent_count} sent, {failed_count} errors...")
-            except BadRequest:
-                pass
-        await asyncio.sleep(0.1)
-    
-    if should_pin and pin_message_ids:
-        await status_msg.edit_text(f"Publishing complete. Now pinning messages for {len(pin_message_ids)} users...")
-        
-        for user_id_str, msg_id in pin_message_ids.items():
-            try:
-                await bot.pin_chat_message(
-                    chat_id=int(user_id_str),
-                    message_id=msg_id,
-                    disable_notification=False
-                )
-                pin_count += 1
-                _last_pinned_messages[int(user_id_str)] = {
-                    'message_id': msg_id,
-                    'timestamp': time.time()
-                }
-            except Exception:
-                pin_failed += 1
-            await asyncio.sleep(0.1)
+    raise ValueError("Usage: /publish [pin] [in 30m | in 2h | at 18:30 | at 2025-01-31 18:30]")
+
+
+async def run_publish_job(bot, job, status_msg):
+    pin_text = " with PIN" if job.pin else ""
+    total_users_to_try = len(job.recipients)
+
+    async def report_progress(job):
+        try:
+            pin_progress = f", {job.pinned_count} pinned" if job.pin else ""
+            await status_msg.edit_text(f"Publishing{pin_text}: {job.processed}/{total_users_to_try} processed, {job.sent_count} sent{pin_progress}, {job.failed_count} errors...")
+        except BadRequest:
+            pass
+
+    def remember_pinned(user_id, msg_id):
+        _last_pinned_messages[user_id] = {
+            'message_id': msg_id,
+            'timestamp': time.time()
+        }
+
+    job.on_progress = report_progress
+    job.on_pinned = remember_pinned
+    await job.run()
     
-    status_text = f"Publishing complete: {sent_count} successfully sent, {failed_count} errors out of {total_users_to_try} attempted users."
-    if should_pin:
-        status_text += f" PIN results: {pin_count} pinned, {pin_failed} failed to pin."
+    status_text = f"Publishing complete: {job.sent_count} successfully sent, {job.failed_count} errors out of {total_users_to_try} attempted users."
+    if job.pin:
+        status_text += f" PIN results: {job.pinned_count} pinned, {job.pin_failed_count} failed to pin."
+
+    pruned = broadcast.prune_dead_subscribers(job)
+    if pruned:
+        pruned_preview = ", ".join(str(user_id) for user_id in pruned[:20])
+        if len(pruned) > 20:
+            pruned_preview += ", ..."
+        status_text += f"\nRemoved {len(pruned)} unreachable subscribers (blocked the bot or deleted their account): {pruned_preview}"
+    elif job.unreachable and broadcast.prune_after_failures:
+        status_text += f"\n{len(job.unreachable)} subscribers are unreachable; they will be removed after {broadcast.prune_after_failures} failed broadcasts in a row."
         
     try:
         await status_msg.edit_text(status_text)
     except BadRequest:
-        await message.reply_text(status_text)
-        
-    publish_state["active"] = False
-    publish_state["content"] = None
-    publish_state["pin"] = False
+        await bot.send_message(status_msg.chat_id, status_text)
+
+
+async def start_campaign(bot, job):
+    status_chat_id = job.status_chat_id or admin_id
+    pin_text = " with PIN" if job.pin else ""
+
+    if job.started:
+        status_msg = await bot.send_message(
+            status_chat_id,
+            f"Resuming interrupted campaign {job.job_id}: {job.processed}/{len(job.recipients)} already processed..."
+        )
+    else:
+        banned = load_banned()
+        job.set_recipients(user_id for user_id in load_users() if user_id not in banned)
+        job.save()
+        if not job.recipients:
+            job.finished = True
+            job.save()
+            await bot.send_message(status_chat_id, f"Campaign {job.job_id}: no users to publish to (all subscribed users are banned or list is empty).")
+            return
+        status_msg = await bot.send_message(status_chat_id, f"Campaign {job.job_id}: publishing{pin_text} to {len(job.recipients)} users...")
+
+    await run_publish_job(bot, job, status_msg)
+
+
+async def run_campaign_scheduler(bot):
+    broadcast.campaigns.load(bot)
+    while not stop_telegram_bot_event.is_set():
+        job = broadcast.campaigns.next_due()
+        if job is None:
+            await asyncio.sleep(CAMPAIGN_POLL_INTERVAL)
+            continue
+
+        broadcast.campaigns.take(job)
+        try:
+            await start_campaign(bot, job)
+        except Exception as e:
+            print(f"Error running campaign {job.job_id}: {e}")
+            await asyncio.sleep(CAMPAIGN_POLL_INTERVAL)
+        finally:
+            broadcast.campaigns.done(job)
+
+
+async def unpublish_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not get_identity(update, context).is_admin: return
+
+    if not context.args or len(context.args) != 1:
+        await update.message.reply_text("Usage: /unpublish <campaign_id> - delete a broadcast from every chat it was delivered to.")
+        return
+
+    job_id = context.args[0]
+    if broadcast.campaigns.find(job_id) is not None:
+        await update.message.reply_text(f"Campaign {job_id} is still queued or running. Cancel it first with /campaigns cancel {job_id}.")
+        return
+
+    receipts = broadcast.load_receipts(job_id)
+    if not receipts:
+        await update.message.reply_text(f"No delivered messages found for campaign {job_id}.")
+        return
+
+    status_msg = await update.message.reply_text(f"Unpublishing campaign {job_id} from {len(receipts)} chats...")
+    recall_task = context.application.create_task(run_unpublish_job(context.bot, broadcast.RecallJob(context.bot, job_id, receipts), status_msg))
+    _recall_tasks.add(recall_task)
+    recall_task.add_done_callback(_recall_tasks.discard)
+
+
+async def run_unpublish_job(bot, recall, status_msg):
+    async def report_progress(recall):
+        try:
+            await status_msg.edit_text(f"Unpublishing {recall.job_id}: {recall.processed}/{recall.total} processed, {recall.deleted_count} deleted, {recall.failed_count} errors...")
+        except BadRequest:
+            pass
+
+    recall.on_progress = report_progress
+    try:
+        await recall.run()
+    except asyncio.CancelledError:
+        try:
+            await status_msg.edit_text(f"Unpublishing {recall.job_id} interrupted after {recall.processed}/{recall.total} chats. Run /unpublish {recall.job_id} again to continue.")
+        except Exception:
+            pass
+        raise
+
+    for user_id, message_ids in recall.receipts.items():
+        pinned = _last_pinned_messages.get(user_id)
+        if pinned and pinned['message_id'] in message_ids:
+            del _last_pinned_messages[user_id]
+
+    status_text = f"Unpublishing complete: deleted from {recall.deleted_count} chats, {recall.failed_count} errors out of {recall.total}."
+    try:
+        await status_msg.edit_text(status_text)
+    except BadRequest:
+        await bot.send_message(status_msg.chat_id, status_text)
+
+
+async def apistats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not get_identity(update, context).is_admin: return
+
+    if context.args and context.args[0].lower() == "reset":
+        outbound.metrics.reset()
+        await update.message.reply_text("Bot API statistics reset.")
+        return
+    await update.message.reply_text(outbound.metrics.format())
+
+
+async def campaigns_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not get_identity(update, context).is_admin: return
+
+    if context.args and context.args[0].lower() == "cancel":
+        if len(context.args) != 2:
+            await update.message.reply_text("Usage: /campaigns cancel <campaign_id>")
+            return
+        job = broadcast.campaigns.cancel(context.args[1])
+        if job is None:
+            await update.message.reply_text(f"Campaign {context.args[1]} not found.")
+        else:
+            await update.message.reply_text(f"Campaign {job.job_id} cancelled.")
+        return
+
+    jobs = broadcast.campaigns.jobs()
+    if not jobs:
+        await update.message.reply_text("No campaigns queued.")
+        return
+
+    lines = []
+    for job in jobs:
+        pin_text = " (pin)" if job.pin else ""
+        if job is broadcast.campaigns.running:
+            total = len(job.recipients) if job.started else 0
+            lines.append(f"▶️ {job.job_id}{pin_text}: running, {job.processed}/{total} processed")
+        elif job.scheduled_at and not job.is_due():
+            lines.append(f"🕒 {job.job_id}{pin_text}: at {datetime.fromtimestamp(job.scheduled_at).strftime('%Y-%m-%d %H:%M')}")
+        else:
+            lines.append(f"⏳ {job.job_id}{pin_text}: waiting")
+    lines.append("\n/campaigns cancel <campaign_id> to cancel one.")
+    await update.message.reply_text("\n".join(lines))
 
 
 async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from roles import is_admin, is_operator
-    if not is_admin(update.effective_user.id) and not is_operator(update.effective_user.id): return
+    if not get_identity(update, context).has_role: return
 
     target_user_id, has_arg, _ = await _get_target_user_id_from_context(update, context, expect_arg_after_id=False)
 
@@ -1053,14 +1378,10 @@ async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
          return
 
     try:
-        banned_users = load_banned()
-        if target_user_id_str in banned_users:
+        if not add_to_banned(target_user_id_str):
             await update.message.reply_text(f"User {target_user_id_str} is already banned."); return
 
-        banned_users.add(target_user_id_str); save_banned(banned_users)
-        users_list = load_users();
-        if target_user_id_str in users_list: 
-            users_list.remove(target_user_id_str); save_users(users_list)
+        remove_from_users(target_user_id_str)
 
         await update.message.reply_text(
             f"User {target_user_id_str} banned and removed from subscriptions. "
@@ -1070,8 +1391,7 @@ async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from roles import is_admin, is_operator
-    if not is_admin(update.effective_user.id) and not is_operator(update.effective_user.id): return
+    if not get_identity(update, context).has_role: return
 
     target_user_id, has_arg, _ = await _get_target_user_id_from_context(update, context, expect_arg_after_id=False)
 
@@ -1085,11 +1405,9 @@ async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
          return
 
     try:
-        banned_users = load_banned()
-        if target_user_id_str not in banned_users:
+        if not remove_from_banned(target_user_id_str):
             await update.message.reply_text(f"User {target_user_id_str} is not banned."); return
 
-        banned_users.remove(target_user_id_str); save_banned(banned_users)
         await update.message.reply_text(f"User {target_user_id_str} unbanned.")
     except Exception as e:
         await update.message.reply_text(f"An error occurred while trying to unban user {target_user_id_str}.")
@@ -1114,8 +1432,7 @@ async def set_cooldown(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def cancel_sending(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from roles import is_admin, is_operator
-    if not is_admin(update.effective_user.id) and not is_operator(update.effective_user.id): return
+    if not get_identity(update, context).has_role: return
 
     admin_user_id_str = str(update.effective_user.id)
     cancelled_something = False
@@ -1125,8 +1442,7 @@ async def cancel_sending(update: Update, context: ContextTypes.DEFAULT_TYPE):
         cancelled_something = True
 
     if publish_state["active"]:
-        publish_state["active"] = False
-        publish_state["content"] = None
+        _reset_publish_state()
         cancelled_something = True
 
     if 'confirm_topic_group' in context.chat_data: 
@@ -1142,15 +1458,22 @@ async def cancel_sending(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start_publish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     from roles import is_admin
     if not is_admin(update.effective_user.id): return
+    try:
+        should_pin, send_at = _parse_publish_schedule(context.args)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+
     publish_state["active"] = True
     publish_state["content"] = None
-    publish_state["pin"] = False
+    publish_state["pin"] = should_pin
+    publish_state["send_at"] = send_at
     
-    if context.args and len(context.args) > 0 and context.args[0].lower() == "pin":
-        publish_state["pin"] = True
-        await update.message.reply_text("Send content for mass mailing with PIN, or /cancel.")
+    schedule_text = f" (scheduled for {datetime.fromtimestamp(send_at).strftime('%Y-%m-%d %H:%M')})" if send_at else ""
+    if should_pin:
+        await update.message.reply_text(f"Send content for mass mailing with PIN{schedule_text}, or /cancel.")
     else:
-        await update.message.reply_text("Send content for mass mailing, or /cancel.")
+        await update.message.reply_text(f"Send content for mass mailing{schedule_text}, or /cancel.")
 
 
 async def confirm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1170,11 +1493,9 @@ async def subscribe_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if bot_paused and user.id != admin_id:
         return
     
-    if user_id_str in load_banned(): 
+    if get_identity(update, context).is_banned: 
         await update.message.reply_text("You are banned and cannot subscribe."); return
-    users = load_users()
-    if user_id_str not in users:
-        users.add(user_id_str); save_users(users)
+    if add_to_users(user_id_str):
         await update.message.reply_text("You have successfully subscribed to mass mailings!")
     else:
         await update.message.reply_text("You are already subscribed.")
@@ -1189,9 +1510,7 @@ async def unsubscribe_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if bot_paused and user.id != admin_id:
         return
     
-    users = load_users()
-    if user_id_str in users:
-        users.remove(user_id_str); save_users(users)
+    if remove_from_users(user_id_str):
         await update.message.reply_text("You have unsubscribed from mass mailings.")
     else:
         await update.message.reply_text("You were not subscribed.")
@@ -1539,6 +1858,47 @@ async def resume_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🔹 Bot operation resumed. All features are now available again.")
 
 
+def _find_external_changes():
+    return get_externally_modified_stores(), roles.roles_file_changed()
+
+
+async def reload_externally_modified_files():
+    changed_stores, roles_changed = await asyncio.to_thread(_find_external_changes)
+    if changed_stores:
+        reload_stores(changed_stores)
+    if roles_changed:
+        roles.load_roles(use_cache=False)
+
+
+def build_http_request(get_updates=False):
+    """Creates the Bot API HTTP client from the http_* (or get_updates_*) options in config.ini"""
+    prefix = "get_updates" if get_updates else "http"
+    request_kwargs = {}
+
+    pool_size = config_mngr.get_int_config(f'{prefix}_pool_size', fallback=None)
+    if pool_size:
+        request_kwargs['connection_pool_size'] = pool_size
+    elif get_updates:
+        request_kwargs['connection_pool_size'] = 1
+    for timeout in ('connect', 'read', 'write', 'pool'):
+        value = config_mngr.get_float_config(f'{prefix}_{timeout}_timeout', fallback=None)
+        if value is None and get_updates:
+            value = config_mngr.get_float_config(f'http_{timeout}_timeout', fallback=None)
+        if value is not None:
+            request_kwargs[f'{timeout}_timeout'] = value
+
+    http_version = config_mngr.get_config('http_version', fallback='').strip() or "1.1"
+    if http_version.startswith("2"):
+        if importlib.util.find_spec("h2") is None:
+            print("HTTP/2 requested but the 'h2' package is missing (pip install \"httpx[http2]\"), using HTTP/1.1.")
+            http_version = "1.1"
+        else:
+            http_version = "2"
+    request_kwargs['http_version'] = http_version
+
+    return HTTPXRequest(**request_kwargs)
+
+
 async def run_telegram_bot(token: str, admin_id_param: int, initial_cooldown: int, config_manager_instance: ConfigManager):
 
     global admin_id, current_cooldown_seconds, topic_mode_group_id, config_mngr
@@ -1547,6 +1907,21 @@ async def run_telegram_bot(token: str, admin_id_param: int, initial_cooldown: in
     current_cooldown_seconds = initial_cooldown
     config_mngr = config_manager_instance
 
+    set_storage_engine(config_mngr.get_config('user_details_engine', fallback='sqlite'))
+
+    link_max_age_days = config_mngr.get_int_config('message_links_max_age_days', fallback=None)
+    message_links.configure(
+        max_entries=config_mngr.get_int_config('message_links_max_entries', fallback=None),
+        max_age=link_max_age_days * 24 * 60 * 60 if link_max_age_days is not None else None
+    )
+    message_links.open()
+    file_watch_interval = config_mngr.get_int_config('file_watch_interval', fallback=5)
+    broadcast.configure(
+        rate=config_mngr.get_int_config('broadcast_rate', fallback=None),
+        worker_count=config_mngr.get_int_config('broadcast_workers', fallback=None),
+        prune_after=config_mngr.get_int_config('prune_after_failures', fallback=None)
+    )
+
     reactions.initialize(message_links)
     message_edit_handler.initialize(message_links)
     pins.initialize(message_links, sys.modules[__name__])
@@ -1562,7 +1937,19 @@ async def run_telegram_bot(token: str, admin_id_param: int, initial_cooldown: in
             config_mngr.set_config('topic_mode_group_id', '') 
             config_mngr.save_config()
 
-    app = Application.builder().token(token).build()
+    outbound_scheduler = outbound.OutboundScheduler(
+        rate=config_mngr.get_int_config('outbound_rate', fallback=None),
+        workers=config_mngr.get_int_config('outbound_workers', fallback=None)
+    )
+    app = (
+        Application.builder()
+        .token(token)
+        .request(build_http_request())
+        .get_updates_request(build_http_request(get_updates=True))
+        .rate_limiter(outbound_scheduler)
+        .concurrent_updates(update_context.PerChatUpdateProcessor())
+        .build()
+    )
 
     if 'user_to_bot_message_map' not in app.bot_data:
         app.bot_data['user_to_bot_message_map'] = {}
@@ -1571,6 +1958,8 @@ async def run_telegram_bot(token: str, admin_id_param: int, initial_cooldown: in
     if 'effective_user_cache' not in app.bot_data: 
         app.bot_data['effective_user_cache'] = {}
     
+    update_context.register_handlers(app)
+    
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", start))
     app.add_handler(CommandHandler("h", start))
@@ -1580,6 +1969,9 @@ async def run_telegram_bot(token: str, admin_id_param: int, initial_cooldown: in
     app.add_handler(CommandHandler("cooldown", set_cooldown))
     app.add_handler(CommandHandler(["cancel", "c"], cancel_sending))
     app.add_handler(CommandHandler("confirm", confirm_command))
+    app.add_handler(CommandHandler("campaigns", campaigns_command))
+    app.add_handler(CommandHandler("unpublish", unpublish_command))
+    app.add_handler(CommandHandler("apistats", apistats_command))
     app.add_handler(CommandHandler("mode", mode_command))
     app.add_handler(CommandHandler("whois", whois_command))
 
@@ -1613,23 +2005,21 @@ async def run_telegram_bot(token: str, admin_id_param: int, initial_cooldown: in
     import operator_handler
     operator_handler.initialize(message_links, sys.modules[__name__])
     
-    from roles import get_all_admins, get_all_operators, is_admin, is_operator, ensure_main_admin
+    from roles import ensure_main_admin
+    import role_filters
     
     ensure_main_admin(admin_id)
     
-    all_admins = [int(admin_id) for admin_id in get_all_admins()]
-    all_operators = [int(op_id) for op_id in get_all_operators()]
-    
-    admin_filter = filters.User(all_admins) & ~filters.COMMAND & ~filters.StatusUpdate.ALL
+    admin_filter = role_filters.ADMINS & ~filters.COMMAND & ~filters.StatusUpdate.ALL
     app.add_handler(MessageHandler(admin_filter | filters.StatusUpdate.PINNED_MESSAGE, handle_admin_message))
     
-    operator_filter = filters.User(all_operators) & ~filters.COMMAND & ~filters.StatusUpdate.ALL
+    operator_filter = role_filters.OPERATORS & ~filters.COMMAND & ~filters.StatusUpdate.ALL
     app.add_handler(MessageHandler(operator_filter, operator_handler.handle_operator_message))
     
-    all_role_users = all_admins + all_operators
-    user_filter = ~filters.User(all_role_users) & ~filters.COMMAND & ~filters.StatusUpdate.ALL
+    user_filter = ~role_filters.STAFF & ~filters.COMMAND & ~filters.StatusUpdate.ALL
     app.add_handler(MessageHandler(user_filter, forward_to_admin_or_topic))
     
+    campaign_scheduler_task = None
     try:
         await app.initialize()
         await app.start()
@@ -1646,15 +2036,37 @@ async def run_telegram_bot(token: str, admin_id_param: int, initial_cooldown: in
 
         await app.updater.start_polling(drop_pending_updates=True, allowed_updates=["message", "edited_message", "message_reaction"])
 
+        campaign_scheduler_task = app.create_task(run_campaign_scheduler(app.bot))
+
+        loop_ticks = 0
         while not stop_telegram_bot_event.is_set(): 
             await asyncio.sleep(1)
+            loop_ticks += 1
+            if file_watch_interval > 0 and loop_ticks % file_watch_interval == 0:
+                await reload_externally_modified_files()
+            message_links.flush()
+            if message_links.needs_compaction():
+                links, journal_offset = message_links.prepare_compaction()
+                written = await asyncio.to_thread(message_links.write_snapshot, links)
+                message_links.finish_compaction(journal_offset, written)
+            if has_pending_writes():
+                failed_writes = await asyncio.to_thread(write_pending_writes, collect_pending_writes())
+                requeue_pending_writes(failed_writes)
 
     except Exception as e:
         print(f"CRITICAL ERROR in run_telegram_bot: {e}")
         import traceback
         traceback.print_exc()
     finally: 
+        background_tasks = list(_recall_tasks)
+        if campaign_scheduler_task is not None:
+            background_tasks.append(campaign_scheduler_task)
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
         if hasattr(app, 'updater') and app.updater and app.updater.running:
             await app.updater.stop() 
         if hasattr(app, 'running') and app.running: 
             await app.stop()
+        message_links.close()
+        flush_pending_writes()
@@ -0,0 +1,629 @@
+import asyncio
+import json
+import os
+import time
+from array import array
+from itertools import islice
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from outbound import PRIORITY_BULK, TokenBucket, retry_after_seconds
+from user_details import remove_many_from_users
+
+DEFAULT_RATE = 25
+DEFAULT_WORKERS = 8
+MAX_SEND_ATTEMPTS = 3
+NETWORK_RETRY_DELAY = 2
+PROGRESS_INTERVAL = 3
+LIVE_TRAFFIC_COST = 2
+BROADCAST_JOBS_DIR = "broadcast_jobs"
+DELIVERY_FAILURES_FILE = "broadcast_failures.json"
+DEFAULT_PRUNE_AFTER_FAILURES = 1
+DELETE_BATCH_SIZE = 100
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+STATUS_UNREACHABLE = "unreachable"
+STATUS_PINNED = "pinned"
+STATUS_PIN_FAILED = "pin_failed"
+
+
+def yield_to_live_traffic(cost=LIVE_TRAFFIC_COST):
+    """Called by live relay handlers so running broadcasts leave room for their API calls"""
+    limiter.debit(cost)
+
+
+async def call_with_retries(make_request):
+    """Runs one Bot API request under the limiter, retrying flood-waits and network errors.
+
+    Returns a (result, error) pair instead of raising.
+    """
+    error = None
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        await limiter.acquire()
+        try:
+            return await make_request(), None
+        except RetryAfter as e:
+            error = e
+            limiter.pause(retry_after_seconds(e))
+        except (Forbidden, BadRequest) as e:
+            return None, e
+        except NetworkError as e:
+            error = e
+            await asyncio.sleep(NETWORK_RETRY_DELAY * (attempt + 1))
+        except Exception as e:
+            return None, e
+    return None, error
+
+
+def is_unreachable_error(error):
+    """Checks if a send error means the chat will never accept messages again"""
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        return "chat not found" in message or "user is deactivated" in message
+    return False
+
+
+limiter = TokenBucket(DEFAULT_RATE)
+workers = DEFAULT_WORKERS
+prune_after_failures = DEFAULT_PRUNE_AFTER_FAILURES
+
+
+def configure(rate=None, worker_count=None, prune_after=None):
+    """Sets the global broadcast rate (messages per second), the worker pool size and the pruning policy"""
+    global limiter, workers, prune_after_failures
+    if rate is not None:
+        limiter = TokenBucket(rate)
+    if worker_count:
+        workers = worker_count
+    if prune_after is not None:
+        prune_after_failures = prune_after
+
+
+class BroadcastJob:
+    """Copies one message to many recipients through a worker pool and the global limiter.
+
+    Jobs with a job_id are persisted under BROADCAST_JOBS_DIR: a JSON header with
+    the checkpoint cursor, the recipient snapshot, a log with one status line
+    per recipient, so an interrupted job can resume without re-sending, and the
+    (user_id, message_id) receipts of every delivered copy for /unpublish.
+    """
+
+    def __init__(self, bot, from_chat_id, message_id, recipients, on_progress=None,
+                 job_id=None, pin=False, status_chat_id=None, scheduled_at=None):
+        self.bot = bot
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.recipients = recipients
+        self.on_progress = on_progress
+        self.job_id = job_id
+        self.pin = pin
+        self.status_chat_id = status_chat_id
+        self.created = time.time()
+        self.scheduled_at = scheduled_at
+        self.finished = False
+        self.cancelled = False
+        self.cursor = 0
+        self.on_pinned = None
+        self.sent = set()
+        self.failures = {}
+        self.unreachable = set()
+        self.processed = 0
+        self.pinned_count = 0
+        self.pin_failed_count = 0
+        self._unpinned = {}
+        self._log = None
+        self._receipts = None
+
+    @classmethod
+    def create(cls, bot, from_chat_id, message_id, recipients=None, pin=False, status_chat_id=None, scheduled_at=None):
+        """Creates a persisted job; without recipients the snapshot is taken when the job starts"""
+        job_id = f"{time.strftime('%Y%m%d%H%M%S')}-{message_id}"
+        job = cls(
+            bot, from_chat_id, message_id, None,
+            job_id=job_id, pin=pin, status_chat_id=status_chat_id, scheduled_at=scheduled_at
+        )
+        os.makedirs(BROADCAST_JOBS_DIR, exist_ok=True)
+        if recipients is not None:
+            job.set_recipients(recipients)
+        job.save()
+        return job
+
+    def set_recipients(self, recipients):
+        """Fixes the recipient snapshot of the job"""
+        self.recipients = array('q', recipients)
+        if self.job_id:
+            with open(self._path(".recipients"), "wb") as f:
+                self.recipients.tofile(f)
+
+    @property
+    def started(self):
+        return self.recipients is not None
+
+    def is_due(self, now=None):
+        return not self.scheduled_at or self.scheduled_at <= (now if now is not None else time.time())
+
+    def cancel(self):
+        """Stops the job: queued recipients are skipped and the job is closed as finished"""
+        self.cancelled = True
+        self.finished = True
+        self.save()
+
+    @classmethod
+    def load(cls, bot, job_id, header=None):
+        """Loads a persisted job with the statuses recorded so far"""
+        try:
+            if header is None:
+                header = read_job_header(job_id)
+            recipients = None
+            if header.get("started", True):
+                recipients = array('q')
+                with open(os.path.join(BROADCAST_JOBS_DIR, job_id + ".recipients"), "rb") as f:
+                    recipients.frombytes(f.read())
+        except (OSError, ValueError):
+            return None
+
+        job = cls(
+            bot, header["from_chat_id"], header["message_id"], recipients,
+            job_id=job_id, pin=header.get("pin", False), status_chat_id=header.get("status_chat_id"),
+            scheduled_at=header.get("scheduled_at")
+        )
+        job.created = header.get("created", job.created)
+        job.finished = header.get("finished", False)
+        job.cancelled = header.get("cancelled", False)
+        job.cursor = header.get("cursor", 0)
+        job._load_statuses()
+        return job
+
+    def _path(self, suffix):
+        return os.path.join(BROADCAST_JOBS_DIR, self.job_id + suffix)
+
+    def _load_statuses(self):
+        try:
+            with open(self._path(".log"), "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t", 2)
+                    if len(parts) != 3:
+                        continue
+                    try:
+                        user_id = int(parts[0])
+                    except ValueError:
+                        continue
+                    status = parts[1]
+                    if status == STATUS_SENT:
+                        self.sent.add(user_id)
+                        self.failures.pop(user_id, None)
+                        if self.pin and parts[2]:
+                            self._unpinned[user_id] = int(parts[2])
+                    elif status in (STATUS_FAILED, STATUS_UNREACHABLE):
+                        self.failures[user_id] = parts[2]
+                        if status == STATUS_UNREACHABLE:
+                            self.unreachable.add(user_id)
+                    elif status == STATUS_PINNED:
+                        self._unpinned.pop(user_id, None)
+                        self.pinned_count += 1
+                    elif status == STATUS_PIN_FAILED:
+                        self._unpinned.pop(user_id, None)
+                        self.pin_failed_count += 1
+        except OSError:
+            pass
+        self.processed = len(self.sent) + len(self.failures)
+
+    def _record(self, user_id, status, detail):
+        if not self.job_id:
+            return
+        if self._log is None:
+            self._log = open(self._path(".log"), "a", encoding="utf-8")
+        detail = "" if detail is None else str(detail).replace("\n", " ").replace("\t", " ")
+        self._log.write(f"{user_id}\t{status}\t{detail}\n")
+        self._log.flush()
+
+    def _record_receipt(self, user_id, sent_message_id):
+        if not self.job_id or not sent_message_id:
+            return
+        if self._receipts is None:
+            self._receipts = open(self._path(".receipts"), "ab")
+        array('q', (user_id, sent_message_id)).tofile(self._receipts)
+        self._receipts.flush()
+
+    def _advance_cursor(self):
+        recipients = self.recipients or ()
+        while self.cursor < len(recipients) and self._has_status(recipients[self.cursor]):
+            self.cursor += 1
+
+    def _has_status(self, user_id):
+        return user_id in self.sent or user_id in self.failures
+
+    def save(self):
+        """Writes the job header with the current checkpoint"""
+        if not self.job_id:
+            return
+        self._advance_cursor()
+        header = {
+            "job_id": self.job_id,
+            "from_chat_id": self.from_chat_id,
+            "message_id": self.message_id,
+            "pin": self.pin,
+            "status_chat_id": self.status_chat_id,
+            "created": self.created,
+            "scheduled_at": self.scheduled_at,
+            "started": self.started,
+            "finished": self.finished,
+            "cancelled": self.cancelled,
+            "cursor": self.cursor,
+            "total": len(self.recipients) if self.started else None
+        }
+        temp_file = self._path(".json.tmp")
+        try:
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(header, f)
+            os.replace(temp_file, self._path(".json"))
+        except OSError:
+            pass
+
+    @property
+    def sent_count(self):
+        return len(self.sent)
+
+    @property
+    def failed_count(self):
+        return len(self.failures)
+
+    async def send(self, user_id):
+        return await self.bot.copy_message(
+            chat_id=user_id,
+            from_chat_id=self.from_chat_id,
+            message_id=self.message_id,
+            rate_limit_args=PRIORITY_BULK
+        )
+
+    async def run(self):
+        """Delivers the message to every recipient without a recorded status and returns when all workers are done"""
+        queue = asyncio.Queue(maxsize=workers * 2)
+        worker_tasks = [asyncio.create_task(self._worker(queue)) for _ in range(workers)]
+        progress_task = asyncio.create_task(self._report_progress())
+
+        try:
+            unpinned, self._unpinned = self._unpinned, {}
+            for user_id, sent_message_id in unpinned.items():
+                await self._pin(user_id, sent_message_id)
+            for user_id in islice(self.recipients, self.cursor, None):
+                if self.cancelled:
+                    break
+                if not self._has_status(user_id):
+                    await queue.put(user_id)
+            for _ in worker_tasks:
+                await queue.put(None)
+            await asyncio.gather(*worker_tasks)
+            self.finished = True
+        finally:
+            for task in worker_tasks:
+                task.cancel()
+            progress_task.cancel()
+            self.save()
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            if self._receipts is not None:
+                self._receipts.close()
+                self._receipts = None
+        return self
+
+    async def _worker(self, queue):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            await self._deliver(user_id)
+            self.processed += 1
+
+    async def _deliver(self, user_id):
+        sent_message, error = await call_with_retries(lambda: self.send(user_id))
+        if error is not None:
+            self.failures[user_id] = f"{type(error).__name__}: {error}"
+            if is_unreachable_error(error):
+                self.unreachable.add(user_id)
+                self._record(user_id, STATUS_UNREACHABLE, self.failures[user_id])
+            else:
+                self._record(user_id, STATUS_FAILED, self.failures[user_id])
+            return False
+
+        sent_message_id = sent_message.message_id if sent_message else None
+        self.sent.add(user_id)
+        self._record_receipt(user_id, sent_message_id)
+        self._record(user_id, STATUS_SENT, sent_message_id)
+        if self.pin and sent_message_id:
+            await self._pin(user_id, sent_message_id)
+        return True
+
+    async def _pin(self, user_id, sent_message_id):
+        _, error = await call_with_retries(lambda: self.bot.pin_chat_message(
+            chat_id=user_id,
+            message_id=sent_message_id,
+            disable_notification=False,
+            rate_limit_args=PRIORITY_BULK
+        ))
+        if error is not None:
+            self.pin_failed_count += 1
+            self._record(user_id, STATUS_PIN_FAILED, f"{type(error).__name__}: {error}")
+            return False
+
+        self.pinned_count += 1
+        self._record(user_id, STATUS_PINNED, sent_message_id)
+        if self.on_pinned:
+            self.on_pinned(user_id, sent_message_id)
+        return True
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            self.save()
+            if self.on_progress:
+                try:
+                    await self.on_progress(self)
+                except Exception:
+                    pass
+
+
+def load_receipts(job_id):
+    """Returns {user_id: [message_id, ...]} for every copy a persisted job delivered and not yet recalled.
+
+    Jobs written before receipts were stored fall back to the message ids in their status log.
+    """
+    receipts = _read_receipts(job_id)
+    for user_id in _read_recalled(job_id):
+        receipts.pop(user_id, None)
+    return receipts
+
+
+def _read_recalled(job_id):
+    recalled = array('q')
+    try:
+        with open(os.path.join(BROADCAST_JOBS_DIR, job_id + ".recalled"), "rb") as f:
+            data = f.read()
+        recalled.frombytes(data[:len(data) - len(data) % recalled.itemsize])
+    except OSError:
+        pass
+    return recalled
+
+
+def _read_receipts(job_id):
+    receipts = {}
+    receipts_path = os.path.join(BROADCAST_JOBS_DIR, job_id + ".receipts")
+    try:
+        pairs = array('q')
+        with open(receipts_path, "rb") as f:
+            data = f.read()
+        pairs.frombytes(data[:len(data) - len(data) % (2 * pairs.itemsize)])
+        for index in range(0, len(pairs), 2):
+            receipts.setdefault(pairs[index], []).append(pairs[index + 1])
+        return receipts
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return receipts
+
+    try:
+        with open(os.path.join(BROADCAST_JOBS_DIR, job_id + ".log"), "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t", 2)
+                if len(parts) == 3 and parts[1] == STATUS_SENT and parts[2]:
+                    try:
+                        receipts.setdefault(int(parts[0]), []).append(int(parts[2]))
+                    except ValueError:
+                        continue
+    except OSError:
+        pass
+    return receipts
+
+
+class RecallJob:
+    """Deletes every copy a broadcast job delivered, concurrently and under the global limiter.
+
+    Chats cleared so far are appended to <job_id>.recalled, so an interrupted
+    recall continues where it stopped when /unpublish is run again.
+    """
+
+    def __init__(self, bot, job_id, receipts, on_progress=None):
+        self.bot = bot
+        self.job_id = job_id
+        self.receipts = receipts
+        self.on_progress = on_progress
+        self.total = len(receipts)
+        self.processed = 0
+        self.deleted_count = 0
+        self.failures = {}
+        self._recalled = None
+
+    @property
+    def failed_count(self):
+        return len(self.failures)
+
+    async def run(self):
+        queue = asyncio.Queue(maxsize=workers * 2)
+        worker_tasks = [asyncio.create_task(self._worker(queue)) for _ in range(workers)]
+        progress_task = asyncio.create_task(self._report_progress())
+
+        try:
+            for user_id, message_ids in self.receipts.items():
+                await queue.put((user_id, message_ids))
+            for _ in worker_tasks:
+                await queue.put(None)
+            await asyncio.gather(*worker_tasks)
+        finally:
+            for task in worker_tasks:
+                task.cancel()
+            progress_task.cancel()
+            if self._recalled is not None:
+                self._recalled.close()
+                self._recalled = None
+        return self
+
+    async def _worker(self, queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            await self._delete(*item)
+            self.processed += 1
+
+    async def _delete(self, user_id, message_ids):
+        for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+            batch = message_ids[start:start + DELETE_BATCH_SIZE]
+            if len(batch) == 1:
+                _, error = await call_with_retries(lambda: self.bot.delete_message(chat_id=user_id, message_id=batch[0], rate_limit_args=PRIORITY_BULK))
+            else:
+                _, error = await call_with_retries(lambda: self.bot.delete_messages(chat_id=user_id, message_ids=batch, rate_limit_args=PRIORITY_BULK))
+            if error is not None:
+                self.failures[user_id] = f"{type(error).__name__}: {error}"
+                return False
+        self.deleted_count += 1
+        self._record_recalled(user_id)
+        return True
+
+    def _record_recalled(self, user_id):
+        try:
+            if self._recalled is None:
+                self._recalled = open(os.path.join(BROADCAST_JOBS_DIR, self.job_id + ".recalled"), "ab")
+            array('q', (user_id,)).tofile(self._recalled)
+            self._recalled.flush()
+        except OSError:
+            pass
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            if self.on_progress:
+                try:
+                    await self.on_progress(self)
+                except Exception:
+                    pass
+
+
+def _load_failure_counts():
+    try:
+        with open(DELIVERY_FAILURES_FILE, "r", encoding="utf-8") as f:
+            return {int(user_id): count for user_id, count in json.load(f).items()}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def _save_failure_counts(counts):
+    temp_file = DELIVERY_FAILURES_FILE + ".tmp"
+    try:
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump({str(user_id): count for user_id, count in counts.items()}, f)
+        os.replace(temp_file, DELIVERY_FAILURES_FILE)
+    except OSError:
+        pass
+
+
+def prune_dead_subscribers(job):
+    """Updates consecutive-failure counts from a finished job and unsubscribes users over the limit.
+
+    Returns the list of pruned user ids. A prune_after_failures of 0 disables pruning.
+    """
+    if not prune_after_failures:
+        return []
+
+    counts = _load_failure_counts()
+    changed = False
+    for user_id in job.sent:
+        if counts.pop(user_id, None) is not None:
+            changed = True
+    for user_id in job.unreachable:
+        counts[user_id] = counts.get(user_id, 0) + 1
+        changed = True
+
+    pruned = [user_id for user_id, count in counts.items() if count >= prune_after_failures]
+    if pruned:
+        remove_many_from_users(pruned)
+        for user_id in pruned:
+            del counts[user_id]
+    if changed:
+        _save_failure_counts(counts)
+    return pruned
+
+
+class CampaignQueue:
+    """Persisted broadcast jobs waiting to run, executed one at a time in schedule order"""
+
+    def __init__(self):
+        self._jobs = {}
+        self.running = None
+
+    def load(self, bot):
+        """Queues every unfinished job found on disk"""
+        for job in load_unfinished_jobs(bot):
+            self._jobs.setdefault(job.job_id, job)
+
+    def add(self, job):
+        self._jobs[job.job_id] = job
+
+    def jobs(self):
+        """Returns the running job followed by the queued ones in schedule order"""
+        queued = sorted(self._jobs.values(), key=lambda job: (job.scheduled_at or 0, job.created))
+        if self.running is not None:
+            return [self.running] + [job for job in queued if job is not self.running]
+        return queued
+
+    def next_due(self, now=None):
+        due = [job for job in self._jobs.values() if job.is_due(now)]
+        if not due:
+            return None
+        return min(due, key=lambda job: (job.scheduled_at or 0, job.created))
+
+    def find(self, job_id):
+        """Returns the running or queued job with this id"""
+        if self.running is not None and self.running.job_id == job_id:
+            return self.running
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self._jobs.pop(job_id, None)
+        if job is None and self.running is not None and self.running.job_id == job_id:
+            job = self.running
+        if job is None:
+            return None
+        job.cancel()
+        return job
+
+    def take(self, job):
+        self._jobs.pop(job.job_id, None)
+        self.running = job
+
+    def done(self, job):
+        if self.running is job:
+            self.running = None
+
+
+campaigns = CampaignQueue()
+
+
+def read_job_header(job_id):
+    """Reads only the JSON header of a persisted job"""
+    with open(os.path.join(BROADCAST_JOBS_DIR, job_id + ".json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_unfinished_jobs(bot):
+    """Returns the persisted jobs that were interrupted before finishing, oldest first"""
+    if not os.path.isdir(BROADCAST_JOBS_DIR):
+        return []
+
+    jobs = []
+    for file_name in sorted(os.listdir(BROADCAST_JOBS_DIR)):
+        if not file_name.endswith(".json"):
+            continue
+        job_id = file_name[:-len(".json")]
+        try:
+            header = read_job_header(job_id)
+        except (OSError, ValueError):
+            continue
+        if header.get("finished", False) or header.get("cancelled", False):
+            continue
+        job = BroadcastJob.load(bot, job_id, header)
+        if job:
+            jobs.append(job)
+    return jobs
@@ -25,6 +25,20 @@ class ConfigManager:
     def get_config(self, key, section='DEFAULT', fallback=''):
         return self.config.get(section, key, fallback=fallback)
 
+    def get_int_config(self, key, section='DEFAULT', fallback=0):
+        value = self.config.get(section, key, fallback='').strip()
+        try:
+            return int(value) if value else fallback
+        except ValueError:
+            return fallback
+
+    def get_float_config(self, key, section='DEFAULT', fallback=0.0):
+        value = self.config.get(section, key, fallback='').strip()
+        try:
+            return float(value) if value else fallback
+        except ValueError:
+            return fallback
+
     def set_config(self, key, value, section='DEFAULT'):
         if section not in self.config:
             self.config[section] = {}
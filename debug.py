@@ -2,6 +2,8 @@ from telegram import Update, Bot
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters, Application
 import datetime
 
+import outbound
+
 debug_status = "off"
 debug_target_chat_id = None
 
@@ -37,6 +39,7 @@ async def manage_debug_command(update: Update, context: ContextTypes.DEFAULT_TYP
             "Debug mode commands:\n"
             "/debug on - Forward all messages to admin\n"
             "/debug off - Turn off debug mode\n"
+            "/debug status - Show debug mode and message link statistics\n"
             "/debug [chat_id] - Forward all messages to specified chat",
             message_thread_id=getattr(update.message, 'message_thread_id', None)
         )
@@ -44,7 +47,21 @@ async def manage_debug_command(update: Update, context: ContextTypes.DEFAULT_TYP
     
     command_arg = context.args[0].lower()
     
-    if command_arg == "off":
+    if command_arg == "status":
+        status_lines = [f"🔹 Debug mode: {debug_status}"]
+        if debug_target_chat_id:
+            status_lines.append(f"🔹 Debug target chat: {debug_target_chat_id}")
+        if message_links_manager is not None and hasattr(message_links_manager, 'stats'):
+            links_stats = message_links_manager.stats()
+            status_lines.append(
+                f"🔹 Message links: {links_stats['links']} "
+                f"(~{links_stats['memory_bytes'] // 1024} KB, limit {links_stats['max_entries'] or 'none'})"
+            )
+        await update.message.reply_text(
+            "\n".join(status_lines),
+            message_thread_id=getattr(update.message, 'message_thread_id', None)
+        )
+    elif command_arg == "off":
         debug_status = "off"
         debug_target_chat_id = None
         if configuration_manager:
@@ -206,7 +223,8 @@ async def debug_all_incoming_messages(update: Update, context: ContextTypes.DEFA
     header_info_parts.append(message_meta_details)
 
     complete_header = "\n".join(header_info_parts)
-    await forward_message_to_debug_chat(context.bot, current_message, complete_header)
+    with outbound.priority(outbound.PRIORITY_DEBUG):
+        await forward_message_to_debug_chat(context.bot, current_message, complete_header)
 
 def register_debug_handlers(app: Application):
     app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, debug_all_incoming_messages), group=10)
@@ -241,7 +259,7 @@ async def log_bot_action_to_debug(bot: Bot, target_chat_id, text_of_message, is_
     final_log_entry = f"{log_message_header}\n{text_of_message}"
 
     try:
-        await bot.send_message(debug_target_chat_id, final_log_entry)
+        await bot.send_message(debug_target_chat_id, final_log_entry, rate_limit_args=outbound.PRIORITY_DEBUG)
     except Exception as e:
         pass
     
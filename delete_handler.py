@@ -6,7 +6,9 @@ from telegram.error import BadRequest
 import html
 from datetime import datetime
 
-_message_links = {}
+from update_context import get_identity
+
+_message_links = None
 bot_core = None
 
 def initialize(message_links_from_core, bot_core_module_param=None):
@@ -27,13 +29,12 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(update.effective_chat.id, "Error: Delete command is not configured correctly. Please contact admin.")
         return
 
+    identity = get_identity(update, context)
     if hasattr(bot_core, 'bot_paused') and bot_core.bot_paused:
-        from roles import is_admin
-        if not is_admin(update.effective_user.id):
+        if not identity.is_admin:
             return
 
-    from roles import is_admin, is_operator
-    if not is_admin(update.effective_user.id) and not is_operator(update.effective_user.id):
+    if not identity.has_role:
         return
     
     if not update.message or not update.message.reply_to_message:
@@ -75,13 +76,13 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     admin_chat_id = update.effective_chat.id
     admin_message_id = reply_to_message.message_id
     
-    admin_key = f"{admin_chat_id}:{admin_message_id}"
     user_message_id = None
     is_from_user = False
     
-    if admin_key in _message_links:
-        user_message_id = _message_links[admin_key].get('user_message_id')
-        is_from_user = _message_links[admin_key].get('is_from_user', False)
+    link_info = _message_links.get_by_admin(admin_chat_id, admin_message_id) if _message_links is not None else None
+    if link_info:
+        user_message_id = link_info.user_message_id
+        is_from_user = link_info.is_from_user
     
     if not user_message_id:
         await context.bot.send_message(
@@ -0,0 +1,87 @@
+from array import array
+from bisect import bisect_left
+
+
+class IntSet:
+    """Sorted set of 64-bit integer ids backed by a compact array.
+
+    Membership is O(log n) and accepts ints or numeric strings. Single ids
+    are inserted and removed in place; like a built-in set, the set must not
+    be changed while it is being iterated.
+    """
+
+    __slots__ = ('_values',)
+
+    def __init__(self, values=()):
+        self._values = array('q', sorted(set(int(value) for value in values)))
+
+    def _find(self, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return None, -1
+        index = bisect_left(self._values, value)
+        return value, index
+
+    def __contains__(self, value):
+        value, index = self._find(value)
+        return value is not None and index < len(self._values) and self._values[index] == value
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __bool__(self):
+        return len(self._values) > 0
+
+    def __repr__(self):
+        return f"IntSet({len(self._values)} ids)"
+
+    def add(self, value):
+        """Adds an id; returns False if it was already present"""
+        value, index = self._find(value)
+        if value is None:
+            raise ValueError("IntSet only holds integer ids")
+        values = self._values
+        if index < len(values) and values[index] == value:
+            return False
+        values.insert(index, value)
+        return True
+
+    def discard(self, value):
+        """Removes an id if present; returns False if it was missing"""
+        value, index = self._find(value)
+        values = self._values
+        if value is None or index >= len(values) or values[index] != value:
+            return False
+        values.pop(index)
+        return True
+
+    def difference_update(self, values):
+        """Removes many ids with a single rebuild; returns how many were present"""
+        drop = set()
+        for value in values:
+            try:
+                drop.add(int(value))
+            except (TypeError, ValueError):
+                continue
+        kept = array('q', (value for value in self._values if value not in drop))
+        removed = len(self._values) - len(kept)
+        if removed:
+            self._values = kept
+        return removed
+
+    def remove(self, value):
+        if not self.discard(value):
+            raise KeyError(value)
+
+    def copy(self):
+        result = IntSet()
+        result._values = array('q', self._values)
+        return result
+
+    def memory_usage(self):
+        """Returns the number of bytes used by the id array"""
+        return self._values.buffer_info()[1] * self._values.itemsize
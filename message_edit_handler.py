@@ -18,20 +18,10 @@ def initialize(core_message_links):
     global message_links
     message_links = core_message_links
 
-def update_message_link_with_original_text(key, original_text):
-    global message_links
-    if key in message_links:
-        message_links[key]['original_text'] = original_text
-        
-        if 'admin_chat_id' in message_links[key] and 'admin_message_id' in message_links[key]:
-            admin_key = f"{message_links[key]['admin_chat_id']}:{message_links[key]['admin_message_id']}"
-            if admin_key in message_links:
-                message_links[admin_key]['original_text'] = original_text
-                
-        elif 'user_id' in message_links[key] and 'user_message_id' in message_links[key]:
-            user_key = f"{message_links[key]['user_id']}:{message_links[key]['user_message_id']}"
-            if user_key in message_links:
-                message_links[user_key]['original_text'] = original_text
+def update_message_link_with_original_text(chat_id, message_id, original_text):
+    if message_links is None:
+        return False
+    return message_links.set_original_text(chat_id, message_id, original_text)
                 
 async def handle_deleted_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     import bot_core
@@ -50,17 +40,16 @@ async def handle_deleted_message(update: Update, context: ContextTypes.DEFAULT_T
     user_id_str = str(user_id)
     message_id = deleted_message.message_id
     
-    if user_id_str in bot_core.load_banned(): 
+    if bot_core.is_banned(user_id_str): 
         return
     
-    user_key = f"{user_id}:{message_id}"
+    admin_data = message_links.get_by_user(user_id, message_id)
     
-    if user_key not in message_links:
+    if not admin_data:
         return
         
-    admin_data = message_links[user_key]
-    admin_chat_id = bot_core.topic_mode_group_id if bot_core.topic_mode_group_id is not None else admin_data['admin_chat_id']
-    admin_message_id = admin_data['admin_message_id']
+    admin_chat_id = bot_core.topic_mode_group_id if bot_core.topic_mode_group_id is not None else admin_data.admin_chat_id
+    admin_message_id = admin_data.admin_message_id
     
     from datetime import datetime
     local_time = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
@@ -128,16 +117,15 @@ async def handle_user_edited_message(update: Update, context: ContextTypes.DEFAU
     user_id_str = str(user.id)
     edited_message = update.edited_message
     
-    if user_id_str in bot_core.load_banned(): 
+    if bot_core.is_banned(user_id_str): 
         return
     
-    user_key = f"{user.id}:{edited_message.message_id}"
-    if user_key not in message_links:
+    admin_data = message_links.get_by_user(user.id, edited_message.message_id)
+    if not admin_data:
         return
         
-    admin_data = message_links[user_key]
-    admin_chat_id = bot_core.topic_mode_group_id if bot_core.topic_mode_group_id is not None else admin_data['admin_chat_id']
-    admin_message_id = admin_data['admin_message_id']
+    admin_chat_id = bot_core.topic_mode_group_id if bot_core.topic_mode_group_id is not None else admin_data.admin_chat_id
+    admin_message_id = admin_data.admin_message_id
     
     from datetime import datetime
     local_time = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
@@ -146,8 +134,8 @@ async def handle_user_edited_message(update: Update, context: ContextTypes.DEFAU
     
     original_text = None
     
-    if 'original_text' in admin_data and admin_data['original_text']:
-        original_text = admin_data['original_text']
+    if admin_data.original_text:
+        original_text = admin_data.original_text
     else:
         try:
             original_text = getattr(edited_message, '_effective_message', {}).get('text', None) or \
@@ -253,9 +241,6 @@ async def _delete_message_safe(bot, chat_id, message_id):
     except Exception as e:
         return False
 
-def _get_link_key_for_admin(admin_chat_id, admin_message_id):
-    return f"{admin_chat_id}:{admin_message_id}"
-
 
 async def _handle_admin_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     import html
@@ -265,54 +250,36 @@ async def _handle_admin_edited_message(update: Update, context: ContextTypes.DEF
     edited_message = update.edited_message
     admin_chat_id = edited_message.chat_id
     admin_message_id = edited_message.message_id
-    admin_key = _get_link_key_for_admin(admin_chat_id, admin_message_id)
     
-    if admin_key in message_links:
-        user_data = message_links[admin_key]
-    else:
-        found_key = None
-        
-        for key, data in message_links.items():
-            if ('admin_message_id' in data and data['admin_message_id'] == admin_message_id):
-                if ('admin_chat_id' in data and (data['admin_chat_id'] == admin_chat_id or 
-                        (bot_core.topic_mode_group_id is not None and data['admin_chat_id'] == bot_core.topic_mode_group_id))):
-                    found_key = key
-                    break
-        
-        if not found_key and hasattr(edited_message, 'reply_to_message') and edited_message.reply_to_message:
-            reply_msg = edited_message.reply_to_message
-            
-            reply_key = f"{admin_chat_id}:{reply_msg.message_id}"
-            
-            if reply_key in message_links:
-                found_key = reply_key
-        
-        if not found_key:
-            await context.bot.send_message(
-                chat_id=admin_chat_id,
-                text="🔹 Could not find the associated user message. Editing is not possible.",
-                reply_to_message_id=admin_message_id
-            )
-            return
-        
-        user_data = message_links[found_key]
+    user_data = message_links.get_by_admin(admin_chat_id, admin_message_id)
+    
+    if not user_data and bot_core.topic_mode_group_id is not None:
+        user_data = message_links.get_by_admin(bot_core.topic_mode_group_id, admin_message_id)
     
-    user_id = user_data['user_id']
-    user_message_id = user_data['user_message_id']
+    if not user_data and hasattr(edited_message, 'reply_to_message') and edited_message.reply_to_message:
+        user_data = message_links.get_by_admin(admin_chat_id, edited_message.reply_to_message.message_id)
+    
+    if not user_data:
+        await context.bot.send_message(
+            chat_id=admin_chat_id,
+            text="🔹 Could not find the associated user message. Editing is not possible.",
+            reply_to_message_id=admin_message_id
+        )
+        return
+    
+    user_id = user_data.user_id
+    user_message_id = user_data.user_message_id
     
     local_time = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
     fixed_tag = f"[fixed, {local_time}]"
     
     original_text = None
     
-    try:
-        if 'original_text' in user_data and user_data['original_text']:
-            original_text = user_data['original_text']
-    except Exception as e:
-        pass
+    if user_data.original_text:
+        original_text = user_data.original_text
         
     if not original_text:
-        original_text = user_data.get('original_text', None) or getattr(edited_message, 'text', None) or getattr(edited_message, 'caption', None) or '[no data]'
+        original_text = getattr(edited_message, 'text', None) or getattr(edited_message, 'caption', None) or '[no data]'
     
     if edited_message.text:
         edited_text = edited_message.text
@@ -626,17 +593,13 @@ def register_handlers(app):
     import bot_core
     admin_id = bot_core.admin_id
     
-    from roles import get_all_admins, get_all_operators
-    
-    all_admins = [int(admin) for admin in get_all_admins()]
-    all_operators = [int(operator) for operator in get_all_operators()]
-    all_staff = all_admins + all_operators
+    import role_filters
     
-    user_edit_filter = filters.UpdateType.EDITED_MESSAGE & ~filters.User(all_staff)
+    user_edit_filter = filters.UpdateType.EDITED_MESSAGE & ~role_filters.STAFF
     
     app.add_handler(MessageHandler(user_edit_filter, handle_user_edited_message), group=998)
     
-    staff_edit_filter = filters.UpdateType.EDITED_MESSAGE & filters.User(all_staff)
+    staff_edit_filter = filters.UpdateType.EDITED_MESSAGE & role_filters.STAFF
     app.add_handler(MessageHandler(staff_edit_filter, handle_admin_edited_message), group=998)
     
     async def handle_any_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -0,0 +1,378 @@
+import os
+import sys
+import time
+from collections import deque
+
+MESSAGE_LINKS_SNAPSHOT_FILE = "message_links.snapshot"
+MESSAGE_LINKS_JOURNAL_FILE = "message_links.journal"
+COMPACT_AFTER_APPENDS = 50000
+DEFAULT_MAX_ENTRIES = 200000
+DEFAULT_MAX_AGE_SECONDS = 90 * 24 * 60 * 60
+
+
+MESSAGE_ID_BITS = 32
+MESSAGE_ID_MASK = (1 << MESSAGE_ID_BITS) - 1
+
+
+def pack_key(chat_id, message_id):
+    """Packs a (chat_id, message_id) pair into a single integer key"""
+    return (int(chat_id) << MESSAGE_ID_BITS) | int(message_id)
+
+
+def unpack_key(key):
+    """Splits a packed key back into (chat_id, message_id)"""
+    return key >> MESSAGE_ID_BITS, key & MESSAGE_ID_MASK
+
+
+class MessageLink:
+    """A single user <-> admin message mapping"""
+
+    __slots__ = ('user_key', 'admin_key', 'is_from_user', 'topic_id', 'timestamp', 'original_text')
+
+    def __init__(self, user_key, admin_key, is_from_user=True, topic_id=None, timestamp=None):
+        self.user_key = user_key
+        self.admin_key = admin_key
+        self.is_from_user = is_from_user
+        self.topic_id = topic_id
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.original_text = None
+
+    @property
+    def user_id(self):
+        return self.user_key >> MESSAGE_ID_BITS
+
+    @property
+    def user_message_id(self):
+        return self.user_key & MESSAGE_ID_MASK
+
+    @property
+    def admin_chat_id(self):
+        return self.admin_key >> MESSAGE_ID_BITS
+
+    @property
+    def admin_message_id(self):
+        return self.admin_key & MESSAGE_ID_MASK
+
+
+class MessageLinkStore:
+    """Indexed storage of message links with O(1) lookups from either side"""
+
+    def __init__(self, snapshot_file=MESSAGE_LINKS_SNAPSHOT_FILE, journal_file=MESSAGE_LINKS_JOURNAL_FILE,
+                 compact_after=COMPACT_AFTER_APPENDS, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_age=DEFAULT_MAX_AGE_SECONDS):
+        self._by_user = {}
+        self._by_admin = {}
+        self._by_topic = {}
+        self._outbound = {}
+        self._order = deque()
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.compact_after = compact_after
+        self._journal = None
+        self._journal_appends = 0
+
+    def __len__(self):
+        return len(self._by_user)
+
+    def save(self, user_id, user_message_id, admin_chat_id, admin_message_id, is_from_user=True, topic_id=None):
+        """Stores a link and indexes it by both sides and by topic"""
+        link = MessageLink(
+            pack_key(user_id, user_message_id),
+            pack_key(admin_chat_id, admin_message_id),
+            is_from_user, topic_id
+        )
+        self._index(link)
+        self._append_to_journal(link)
+        self.evict()
+        return link
+
+    def configure(self, max_entries=None, max_age=None):
+        """Sets the retention policy; 0 disables the corresponding limit"""
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if max_age is not None:
+            self.max_age = max_age
+        self.evict()
+
+    def evict(self, now=None):
+        """Drops the oldest links beyond the entry limit or older than the age limit"""
+        evicted = 0
+        cutoff = None
+        if self.max_age:
+            cutoff = (now if now is not None else time.time()) - self.max_age
+
+        while self._order:
+            link = self._order[0]
+            if self._is_live(link):
+                over_limit = self.max_entries and len(self._by_user) > self.max_entries
+                expired = cutoff is not None and link.timestamp < cutoff
+                if not over_limit and not expired:
+                    break
+                self._unindex(link)
+                evicted += 1
+            elif not link.is_from_user:
+                self._drop_from_timeline(link)
+            self._order.popleft()
+        return evicted
+
+    def _is_live(self, link):
+        return self._by_user.get(link.user_key) is link or self._by_admin.get(link.admin_key) is link
+
+    def _unindex(self, link):
+        if self._by_user.get(link.user_key) is link:
+            del self._by_user[link.user_key]
+        if self._by_admin.get(link.admin_key) is link:
+            del self._by_admin[link.admin_key]
+        if link.topic_id is not None:
+            topic_links = self._by_topic.get(link.topic_id)
+            if topic_links and topic_links.get(link.admin_key) is link:
+                del topic_links[link.admin_key]
+                if not topic_links:
+                    del self._by_topic[link.topic_id]
+        if not link.is_from_user:
+            self._drop_from_timeline(link)
+
+    def _drop_from_timeline(self, link):
+        user_id = link.user_id
+        timeline = self._outbound.get(user_id)
+        if not timeline:
+            return
+        if timeline[0] is link:
+            del timeline[0]
+        else:
+            try:
+                timeline.remove(link)
+            except ValueError:
+                pass
+        if not timeline:
+            del self._outbound[user_id]
+
+    def memory_usage(self):
+        """Estimates the number of bytes held by the store"""
+        total = sys.getsizeof(self._by_user) + sys.getsizeof(self._by_admin)
+        total += sys.getsizeof(self._by_topic) + sys.getsizeof(self._order)
+        total += sum(sys.getsizeof(topic_links) for topic_links in self._by_topic.values())
+        total += sys.getsizeof(self._outbound)
+        total += sum(sys.getsizeof(timeline) for timeline in self._outbound.values())
+        if self._order:
+            sample = self._order[-1]
+            per_link = sys.getsizeof(sample)
+            per_link += sys.getsizeof(sample.user_key) + sys.getsizeof(sample.admin_key)
+            per_link += sys.getsizeof(sample.timestamp)
+            total += per_link * len(self._order)
+        return total
+
+    def stats(self):
+        """Returns a summary of the store size and retention policy"""
+        return {
+            'links': len(self._by_user),
+            'topics': len(self._by_topic),
+            'memory_bytes': self.memory_usage(),
+            'max_entries': self.max_entries,
+            'max_age': self.max_age
+        }
+
+    def _index(self, link):
+        self._order.append(link)
+        self._by_user[link.user_key] = link
+        self._by_admin[link.admin_key] = link
+        if link.topic_id is not None:
+            self._by_topic.setdefault(link.topic_id, {})[link.admin_key] = link
+        if not link.is_from_user:
+            self._outbound.setdefault(link.user_id, []).append(link)
+
+    def get_by_user(self, user_id, user_message_id):
+        """Returns the link for a message in the user's private chat"""
+        try:
+            return self._by_user.get(pack_key(user_id, user_message_id))
+        except (TypeError, ValueError):
+            return None
+
+    def get_by_admin(self, admin_chat_id, admin_message_id):
+        """Returns the link for a message in the admin chat or a topic"""
+        try:
+            return self._by_admin.get(pack_key(admin_chat_id, admin_message_id))
+        except (TypeError, ValueError):
+            return None
+
+    def find_linked(self, chat_id, message_id):
+        """Returns (chat_id, message_id) of the message on the other side of a link"""
+        link = self.get_by_admin(chat_id, message_id)
+        if link:
+            return link.user_id, link.user_message_id
+
+        link = self.get_by_user(chat_id, message_id)
+        if link:
+            return link.admin_chat_id, link.admin_message_id
+
+        return None, None
+
+    def get_topic_links(self, topic_id):
+        """Returns all links whose admin side lives in the given topic"""
+        return list(self._by_topic.get(topic_id, {}).values())
+
+    def latest_outbound(self, user_id):
+        """Returns the most recent link for a message the bot sent to the user"""
+        try:
+            timeline = self._outbound.get(int(user_id))
+        except (TypeError, ValueError):
+            return None
+        if not timeline:
+            return None
+        for link in reversed(timeline):
+            if self._is_live(link):
+                return link
+        return None
+
+    def outbound_count(self, user_id):
+        """Returns how many messages sent to the user are still linked"""
+        try:
+            return len(self._outbound.get(int(user_id), ()))
+        except (TypeError, ValueError):
+            return 0
+
+    def set_original_text(self, chat_id, message_id, original_text):
+        """Remembers the original text of a linked message"""
+        link = self.get_by_admin(chat_id, message_id) or self.get_by_user(chat_id, message_id)
+        if not link:
+            return False
+        link.original_text = original_text
+        return True
+
+    def get_message_link(self, chat_id, message_id, thread_id=None):
+        """Describes the linked message for debug output"""
+        linked_chat_id, linked_message_id = self.find_linked(chat_id, message_id)
+        if linked_chat_id is None:
+            return None
+        return f"{linked_chat_id}:{linked_message_id}"
+
+    def open(self):
+        """Loads the snapshot and journal tail from disk and starts journaling"""
+        self._load_file(self.snapshot_file)
+        self._load_file(self.journal_file)
+        self.evict()
+        self.compact()
+
+    def flush(self):
+        """Pushes buffered journal entries to disk"""
+        if self._journal:
+            try:
+                self._journal.flush()
+            except OSError:
+                pass
+
+    def close(self):
+        """Compacts the journal into a snapshot and stops journaling"""
+        self.compact()
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    def compact(self):
+        """Writes all live links to a new snapshot and truncates the journal"""
+        self._prune_order()
+        if not self.write_snapshot(self._order):
+            if not self._journal:
+                self._journal = open(self.journal_file, "a", encoding="utf-8")
+            return False
+
+        if self._journal:
+            self._journal.close()
+        self._journal = open(self.journal_file, "w", encoding="utf-8")
+        self._journal_appends = 0
+        return True
+
+    def needs_compaction(self):
+        """Checks if the journal has grown past compact_after appends"""
+        return bool(self._journal and self.compact_after and self._journal_appends >= self.compact_after)
+
+    def prepare_compaction(self):
+        """Starts a background compaction: returns the live links and the journal offset they cover"""
+        self._prune_order()
+        self.flush()
+        self._journal_appends = 0
+        return list(self._order), self._journal.tell()
+
+    def write_snapshot(self, links):
+        """Writes the links to a new snapshot file; safe to run in a worker thread"""
+        temp_file = self.snapshot_file + ".tmp"
+        try:
+            with open(temp_file, "w", encoding="utf-8") as f:
+                for link in links:
+                    f.write(_encode_link(link))
+            os.replace(temp_file, self.snapshot_file)
+            return True
+        except OSError:
+            return False
+
+    def finish_compaction(self, journal_offset, written):
+        """Drops the journal entries covered by the new snapshot, keeping those appended meanwhile"""
+        if not written or not self._journal:
+            return False
+        self.flush()
+        temp_file = self.journal_file + ".tmp"
+        try:
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                f.seek(journal_offset)
+                tail = f.read()
+            with open(temp_file, "w", encoding="utf-8") as f:
+                f.write(tail)
+            self._journal.close()
+            os.replace(temp_file, self.journal_file)
+        except OSError:
+            return False
+        finally:
+            if self._journal.closed:
+                self._journal = open(self.journal_file, "a", encoding="utf-8")
+        return True
+
+    def _prune_order(self):
+        self._order = deque(link for link in self._order if self._is_live(link))
+        self._outbound = {}
+        for link in self._order:
+            if not link.is_from_user:
+                self._outbound.setdefault(link.user_id, []).append(link)
+
+    def _append_to_journal(self, link):
+        if not self._journal:
+            return
+        self._journal.write(_encode_link(link))
+        self._journal_appends += 1
+
+    def _load_file(self, path):
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    link = _decode_link(line)
+                    if link:
+                        self._index(link)
+        except OSError:
+            pass
+
+
+def _encode_link(link):
+    topic_id = "" if link.topic_id is None else link.topic_id
+    return (
+        f"{link.user_id}\t{link.user_message_id}\t{link.admin_chat_id}\t{link.admin_message_id}\t"
+        f"{int(bool(link.is_from_user))}\t{topic_id}\t{link.timestamp:.3f}\n"
+    )
+
+
+def _decode_link(line):
+    parts = line.rstrip("\n").split("\t")
+    if len(parts) != 7:
+        return None
+    try:
+        return MessageLink(
+            pack_key(parts[0], parts[1]),
+            pack_key(parts[2], parts[3]),
+            parts[4] == "1",
+            int(parts[5]) if parts[5] else None,
+            float(parts[6])
+        )
+    except ValueError:
+        return None
@@ -1,8 +1,9 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from roles import is_admin, is_operator
+from update_context import get_identity
+import broadcast
 
-_message_links = {}
+_message_links = None
 bot_core = None
 
 def initialize(message_links_from_core, bot_core_module_param=None):
@@ -18,9 +19,10 @@ async def handle_operator_message(update: Update, context: ContextTypes.DEFAULT_
     if bot_core.bot_paused:
         return False
         
-    user_id = update.effective_user.id
-    if not is_operator(user_id):
+    if not get_identity(update, context).is_operator:
         return False
+
+    broadcast.yield_to_live_traffic()
     
     message = update.message
     if message is None:
@@ -95,7 +97,8 @@ async def handle_operator_message(update: Update, context: ContextTypes.DEFAULT_
                 sent_message.message_id,
                 message.chat_id,
                 message.message_id,
-                is_from_user=False
+                is_from_user=False,
+                topic_id=message_thread_id
             )
             return True
     
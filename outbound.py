@@ -0,0 +1,341 @@
+import asyncio
+import bisect
+import contextvars
+import itertools
+import random
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+import httpx
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+PRIORITY_STAFF = 0
+PRIORITY_RELAY = 1
+PRIORITY_CONFIRMATION = 2
+PRIORITY_DEBUG = 3
+PRIORITY_BULK = 4
+
+DEFAULT_RATE = 30
+DEFAULT_WORKERS = 16
+PRIVATE_CHAT_RATE = 1
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 5
+MAX_CHAT_BUCKETS = 10000
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+RATE_LIMITED_PREFIXES = ("send", "copyMessage", "forwardMessage")
+UNRETRIED_ENDPOINTS = frozenset({"getUpdates"})
+NON_IDEMPOTENT_PREFIXES = RATE_LIMITED_PREFIXES + ("create",)
+UNSENT_REQUEST_ERRORS = (httpx.PoolTimeout, httpx.ConnectTimeout, httpx.ConnectError)
+
+current_priority = contextvars.ContextVar("outbound_priority", default=PRIORITY_RELAY)
+
+
+def retry_after_seconds(error):
+    """Returns the flood-wait of a RetryAfter error in seconds"""
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """Async token bucket shared by every sender that has to respect the same rate"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until a token is available (and any flood-wait pause is over) and takes it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if not self.rate:
+                    return
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + max(0, now - self._updated) * self.rate)
+        self._updated = max(self._updated, now)
+
+    def wait_time(self):
+        """Returns the seconds until a token is available, 0 if one is available now"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if not self.rate:
+            return 0
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def take(self):
+        """Takes a token without waiting; callers check wait_time() first"""
+        if self.rate:
+            self._tokens -= 1
+
+    def pause(self, seconds):
+        """Stops handing out tokens for the given time, e.g. after a RetryAfter"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = max(self._updated, self._paused_until)
+
+    def debit(self, tokens):
+        """Charges tokens for traffic that did not wait on the bucket, slowing down later acquirers"""
+        if self.rate:
+            self._tokens = max(-self.capacity, self._tokens - tokens)
+
+
+class ApiMetrics:
+    """Counts Bot API calls per method: attempts, retries and errors by class"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.calls = defaultdict(int)
+        self.retries = defaultdict(int)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint, error=None, retried=False):
+        self.calls[endpoint] += 1
+        if error is not None:
+            self.errors[endpoint][type(error).__name__] += 1
+        if retried:
+            self.retries[endpoint] += 1
+
+    def reset(self):
+        self.__init__()
+
+    def format(self):
+        """Returns a plain-text report, busiest methods first"""
+        if not self.calls:
+            return "No Bot API calls recorded yet."
+        since = time.strftime('%Y-%m-%d %H:%M', time.localtime(self.started))
+        lines = [f"Bot API calls since {since}:"]
+        for endpoint, count in sorted(self.calls.items(), key=lambda item: item[1], reverse=True):
+            line = f"{endpoint}: {count} attempts"
+            if self.retries[endpoint]:
+                line += f", {self.retries[endpoint]} retried"
+            errors = self.errors.get(endpoint)
+            if errors:
+                line += " (" + ", ".join(f"{name} {errors[name]}" for name in sorted(errors)) + ")"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+metrics = ApiMetrics()
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with jitter for the given 1-based attempt"""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+def is_retryable_network_error(endpoint, error):
+    """Checks if a NetworkError may be retried without risking a duplicate message or topic.
+
+    Calls that create something (sends, copies, forwards, createForumTopic)
+    are only retried when the request never reached Telegram; after a read
+    timeout it usually has been processed already.
+    """
+    if not endpoint.startswith(NON_IDEMPOTENT_PREFIXES):
+        return True
+    return isinstance(error.__cause__, UNSENT_REQUEST_ERRORS)
+
+
+def set_priority(priority):
+    """Sets the priority class of the sends made by the current update or task"""
+    current_priority.set(priority)
+
+
+@contextmanager
+def priority(priority_class):
+    """Runs the sends inside the block (and tasks created in it) with the given priority class"""
+    token = current_priority.set(priority_class)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def _is_rate_limited(endpoint):
+    return endpoint.startswith(RATE_LIMITED_PREFIXES)
+
+
+def _is_private_chat(chat_id):
+    try:
+        return int(chat_id) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Rate limiter and retry layer every Bot API call goes through.
+
+    Sends join one pending list ordered by priority class. A dispatcher hands
+    the first send whose chat bucket has a token (about 1/s for private chats,
+    20/min for groups) to a free worker slot, under the global rate. Staff
+    replies go before relayed user messages, delivery confirmations, the debug
+    mirror and broadcasts, also when they target the same chat, and a chat
+    that is at its limit does not hold up sends to other chats. Other requests
+    (edits, deletes, ...) skip the queue.
+
+    Every call except getUpdates is retried on flood-waits (after the
+    announced retry_after) and on transient network errors (with jittered
+    exponential backoff), up to MAX_ATTEMPTS; see is_retryable_network_error
+    for the calls that are not safe to repeat. Broadcast sends get a single
+    attempt since the broadcast engine retries them itself.
+    """
+
+    def __init__(self, rate=None, workers=None):
+        self.rate = DEFAULT_RATE if rate is None else rate
+        self.worker_count = workers or DEFAULT_WORKERS
+        self._limiter = TokenBucket(self.rate)
+        self._chat_buckets = OrderedDict()
+        self._pending = None
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._slots = None
+        self._dispatcher = None
+        self._in_flight = set()
+
+    async def initialize(self):
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.worker_count)
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def shutdown(self):
+        tasks = [self._dispatcher, *self._in_flight] if self._dispatcher else list(self._in_flight)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher = None
+        for item in self._pending or ():
+            if not item[3].done():
+                item[3].cancel()
+        self._pending = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if _is_private_chat(chat_id):
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            else:
+                bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in UNRETRIED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        priority_class = rate_limit_args if isinstance(rate_limit_args, int) else current_priority.get()
+        attempts = 1 if priority_class == PRIORITY_BULK else MAX_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            retried = attempt > 1
+            try:
+                result = await self._dispatch(callback, args, kwargs, endpoint, data, priority_class)
+            except RetryAfter as e:
+                metrics.record(endpoint, e, retried)
+                delay = retry_after_seconds(e)
+                self._limiter.pause(delay)
+                if attempt == attempts:
+                    raise
+                if not _is_rate_limited(endpoint):
+                    await asyncio.sleep(delay)
+            except BadRequest as e:
+                metrics.record(endpoint, e, retried)
+                raise
+            except NetworkError as e:
+                metrics.record(endpoint, e, retried)
+                if attempt == attempts or not is_retryable_network_error(endpoint, e):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+            except Exception as e:
+                metrics.record(endpoint, e, retried)
+                raise
+            else:
+                metrics.record(endpoint, None, retried)
+                return result
+
+    async def _dispatch(self, callback, args, kwargs, endpoint, data, priority_class):
+        if self._pending is None or not _is_rate_limited(endpoint):
+            return await callback(*args, **kwargs)
+
+        future = asyncio.get_running_loop().create_future()
+        bisect.insort(self._pending, (priority_class, next(self._sequence), data.get("chat_id"), future, callback, args, kwargs))
+        self._wakeup.set()
+        return await future
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                item = await self._next_ready()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._send(item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _next_ready(self):
+        """Waits for the highest-priority pending send that both the global and its chat limit allow"""
+        while True:
+            self._wakeup.clear()
+            self._pending = [item for item in self._pending if not item[3].done()]
+            delay = self._limiter.wait_time()
+            if not delay:
+                delay = None
+                for index, item in enumerate(self._pending):
+                    chat_id = item[2]
+                    bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+                    chat_delay = bucket.wait_time() if bucket else 0
+                    if not chat_delay:
+                        del self._pending[index]
+                        self._limiter.take()
+                        if bucket:
+                            bucket.take()
+                        return item
+                    delay = chat_delay if delay is None else min(delay, chat_delay)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, item):
+        future, callback, args, kwargs = item[3:]
+        try:
+            if future.done():
+                return
+            try:
+                result = await callback(*args, **kwargs)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
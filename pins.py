@@ -2,7 +2,9 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.error import BadRequest
 
-_message_links = {}
+from update_context import get_identity
+
+_message_links = None
 bot_core = None
 
 def initialize(message_links_from_core, bot_core_module_param=None):
@@ -17,13 +19,12 @@ async def pin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(update.effective_chat.id, "Error: Pin command is not configured correctly. Please contact admin.")
         return
 
+    identity = get_identity(update, context)
     if hasattr(bot_core, 'bot_paused') and bot_core.bot_paused:
-        from roles import is_admin
-        if not is_admin(update.effective_user.id):
+        if not identity.is_admin:
             return
 
-    from roles import is_admin, is_operator
-    if not is_admin(update.effective_user.id) and not is_operator(update.effective_user.id):
+    if not identity.has_role:
         return
     
     reply_to_message = update.message.reply_to_message
@@ -78,12 +79,9 @@ async def pin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_pin_error = "Unknown error"
     user_message_to_pin_id = None
 
-    admin_message_key = f"{update.effective_chat.id}:{reply_to_message.message_id}"
-
-    if _message_links and admin_message_key in _message_links:
-        link_info = _message_links[admin_message_key]
-        if link_info.get('user_id') == user_id and link_info.get('user_message_id') and link_info.get('is_from_user', False):
-            user_message_to_pin_id = link_info['user_message_id']
+    link_info = _message_links.get_by_admin(update.effective_chat.id, reply_to_message.message_id) if _message_links is not None else None
+    if link_info and link_info.user_id == user_id and link_info.user_message_id and link_info.is_from_user:
+        user_message_to_pin_id = link_info.user_message_id
 
     try:
         if user_message_to_pin_id:
@@ -130,13 +128,12 @@ async def unpin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(update.effective_chat.id, "Error: Unpin command is not configured correctly. Please contact admin.")
         return
 
+    identity = get_identity(update, context)
     if hasattr(bot_core, 'bot_paused') and bot_core.bot_paused:
-        from roles import is_admin
-        if not is_admin(update.effective_user.id):
+        if not identity.is_admin:
             return
 
-    from roles import is_admin, is_operator
-    if not is_admin(update.effective_user.id) and not is_operator(update.effective_user.id):
+    if not identity.has_role:
         return
     
     args = context.args
@@ -197,11 +194,9 @@ async def unpin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_unpin_error = "Unknown error"
     user_message_to_unpin_id = None
 
-    admin_message_key = f"{update.effective_chat.id}:{reply_to_message.message_id}"
-    if _message_links and admin_message_key in _message_links:
-        link_info = _message_links[admin_message_key]
-        if link_info.get('user_id') == user_id and link_info.get('user_message_id') and link_info.get('is_from_user', False):
-            user_message_to_unpin_id = link_info['user_message_id']
+    link_info = _message_links.get_by_admin(update.effective_chat.id, reply_to_message.message_id) if _message_links is not None else None
+    if link_info and link_info.user_id == user_id and link_info.user_message_id and link_info.is_from_user:
+        user_message_to_unpin_id = link_info.user_message_id
 
     try:
         if user_message_to_unpin_id:
@@ -4,6 +4,8 @@ from telegram.ext import ContextTypes, CommandHandler
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, Forbidden
 
+from update_context import get_identity
+
 REACTION_COMMANDS = {
     "fire": "🔥",
     "zap": "⚡",
@@ -18,32 +20,10 @@ def initialize(core_message_links):
     message_links = core_message_links
 
 def find_linked_message_for_reaction(chat_id, message_id):
-    if not message_links:
+    if message_links is None:
         return None, None
-        
-    key1 = f"{chat_id}:{message_id}"
-    if key1 in message_links:
-        info = message_links[key1]
-        if info.get('user_id') and info.get('user_message_id'):
-            return info.get('user_id'), info.get('user_message_id')
-        if info.get('admin_chat_id') and info.get('admin_message_id'):
-            return info.get('admin_chat_id'), info.get('admin_message_id')
-    
-    for k, v in message_links.items():
-        key_user = f"{v.get('user_id')}:{v.get('user_message_id')}"
-        key_admin = f"{v.get('admin_chat_id')}:{v.get('admin_message_id')}"
-        if key_user == key1:
-            return v.get('admin_chat_id'), v.get('admin_message_id')
-        if key_admin == key1:
-            return v.get('user_id'), v.get('user_message_id')
     
-    for k, v in message_links.items():
-        if v.get('admin_chat_id') == chat_id and v.get('admin_message_id') == message_id:
-            return v.get('user_id'), v.get('user_message_id')
-        if v.get('user_id') == chat_id and v.get('user_message_id') == message_id:
-            return v.get('admin_chat_id'), v.get('admin_message_id')
-    
-    return None, None
+    return message_links.find_linked(chat_id, message_id)
 
 
 async def reaction_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -54,8 +34,7 @@ async def reaction_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cmd = update.message.text.split()[0].lstrip("/").lower()
     
     if cmd == "zap":
-        from roles import is_admin
-        if not is_admin(update.effective_user.id):
+        if not get_identity(update, context).is_admin:
             return 
     
     emoji = REACTION_COMMANDS.get(cmd)
@@ -89,11 +68,7 @@ async def reaction_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def reactions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-            
-    from roles import is_admin
-    
-    if is_admin(user_id):
+    if get_identity(update, context).is_admin:
         reactions_list_text = "/fire — 🔥\n/like — 👍\n/dislike — 👎\n/zap — ⚡\n/clear_reaction - Clear reaction on a message."
     else:
         reactions_list_text = "/fire — 🔥\n/like — 👍\n/dislike — 👎\n/clear_reaction - Clear reaction on a message."
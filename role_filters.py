@@ -0,0 +1,38 @@
+from telegram.ext import filters
+
+from roles import is_admin, is_operator
+
+
+class AdminFilter(filters.MessageFilter):
+    """Matches messages from current administrators, re-checked on every update"""
+
+    __slots__ = ()
+
+    def filter(self, message):
+        return bool(message.from_user) and is_admin(message.from_user.id)
+
+
+class OperatorFilter(filters.MessageFilter):
+    """Matches messages from current operators, re-checked on every update"""
+
+    __slots__ = ()
+
+    def filter(self, message):
+        return bool(message.from_user) and is_operator(message.from_user.id)
+
+
+class StaffFilter(filters.MessageFilter):
+    """Matches messages from current administrators or operators"""
+
+    __slots__ = ()
+
+    def filter(self, message):
+        if not message.from_user:
+            return False
+        user_id = message.from_user.id
+        return is_admin(user_id) or is_operator(user_id)
+
+
+ADMINS = AdminFilter(name="role_filters.ADMINS")
+OPERATORS = OperatorFilter(name="role_filters.OPERATORS")
+STAFF = StaffFilter(name="role_filters.STAFF")
@@ -5,19 +5,34 @@ ROLES_FILE = "roles.json"
 
 _roles_cache = None
 _last_modified = 0
+_admin_ids = frozenset()
+_operator_ids = frozenset()
 
-def load_roles(use_cache=True):
-    global _roles_cache, _last_modified
-    
-    if not os.path.exists(ROLES_FILE):
-        _roles_cache = {"admins": [], "operators": []}
-        return {"admins": [], "operators": []}
+def _copy_roles(roles):
+    return {"admins": list(roles.get("admins", [])), "operators": list(roles.get("operators", []))}
+
+def _set_roles_cache(roles):
+    """Replaces the cached roles and swaps in the id sets used by role checks and filters"""
+    global _roles_cache, _admin_ids, _operator_ids
     
-    file_modified = os.path.getmtime(ROLES_FILE) if os.path.exists(ROLES_FILE) else 0
+    _roles_cache = roles
+    _admin_ids = frozenset(_to_int_ids(roles.get("admins", [])))
+    _operator_ids = frozenset(_to_int_ids(roles.get("operators", [])))
+
+def _to_int_ids(ids):
+    for user_id in ids:
+        try:
+            yield int(user_id)
+        except (TypeError, ValueError):
+            continue
+
+def load_roles(use_cache=True):
+    global _last_modified
     
-    if use_cache and _roles_cache is not None and file_modified <= _last_modified:
-        return _roles_cache.copy()
+    if use_cache and _roles_cache is not None:
+        return _copy_roles(_roles_cache)
     
+    file_modified = _file_mtime()
     try:
         with open(ROLES_FILE, "r", encoding="utf-8") as f:
             roles = json.load(f)
@@ -31,32 +46,55 @@ def load_roles(use_cache=True):
             else:
                 roles["operators"] = []
                 
-            _roles_cache = roles
+            _set_roles_cache(roles)
             _last_modified = file_modified
-            return roles
+            return _copy_roles(roles)
     except (FileNotFoundError, json.JSONDecodeError):
-        _roles_cache = {"admins": [], "operators": []}
+        _set_roles_cache({"admins": [], "operators": []})
+        _last_modified = file_modified
         return {"admins": [], "operators": []}
 
+def _file_mtime():
+    try:
+        return os.path.getmtime(ROLES_FILE)
+    except OSError:
+        return 0
+
+def roles_file_changed():
+    """Checks if roles.json was changed by another process, e.g. add_admin.py"""
+    return _file_mtime() != _last_modified
+
 def save_roles(roles):
-    global _roles_cache, _last_modified
+    global _last_modified
     
+    temp_file = ROLES_FILE + ".tmp"
     try:
-        with open(ROLES_FILE, "w", encoding="utf-8") as f:
+        with open(temp_file, "w", encoding="utf-8") as f:
             json.dump(roles, f, ensure_ascii=False, indent=4)
+        os.replace(temp_file, ROLES_FILE)
         
-        _roles_cache = roles.copy()
+        _set_roles_cache(_copy_roles(roles))
         _last_modified = os.path.getmtime(ROLES_FILE)
     except Exception:
         pass
 
+def _ensure_loaded():
+    if _roles_cache is None:
+        load_roles()
+
 def is_admin(user_id):
-    roles = load_roles()
-    return str(user_id) in roles.get("admins", [])
+    _ensure_loaded()
+    try:
+        return int(user_id) in _admin_ids
+    except (TypeError, ValueError):
+        return False
 
 def is_operator(user_id):
-    roles = load_roles()
-    return str(user_id) in roles.get("operators", [])
+    _ensure_loaded()
+    try:
+        return int(user_id) in _operator_ids
+    except (TypeError, ValueError):
+        return False
 
 def has_role(user_id):
     return is_admin(user_id) or is_operator(user_id)
@@ -108,7 +146,6 @@ def remove_operator(user_id):
     if user_id_str in roles.get("operators", []):
         roles["operators"].remove(user_id_str)
         save_roles(roles)
-        logger.info(f"User {user_id} removed from operators")
         return True
     return False
 
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Chat, Message, Update, User
+
+import outbound
+import update_context
+
+GROUP_ID = -1001
+
+
+def _message_update(update_id, chat_id):
+    chat = Chat(chat_id, Chat.PRIVATE if chat_id > 0 else Chat.SUPERGROUP)
+    message = Message(update_id, None, chat, from_user=User(abs(chat_id), "user", False))
+    return Update(update_id, message=message)
+
+
+def test_staff_send_overtakes_blocked_relays():
+    async def run():
+        scheduler = outbound.OutboundScheduler()
+        await scheduler.initialize()
+        sent = []
+
+        async def send(label):
+            sent.append(label)
+            return label
+
+        async def request(label, priority_class):
+            return await scheduler.process_request(
+                send, (label,), {}, "sendMessage", {"chat_id": GROUP_ID}, priority_class)
+
+        try:
+            # Use up the burst of the group chat so the next relays have to queue.
+            await asyncio.gather(*(request(f"burst{i}", outbound.PRIORITY_RELAY)
+                                   for i in range(outbound.GROUP_CHAT_BURST)))
+            relays = [asyncio.create_task(request(f"relay{i}", outbound.PRIORITY_RELAY)) for i in range(3)]
+            await asyncio.sleep(0.05)
+            staff = asyncio.create_task(request("staff", outbound.PRIORITY_STAFF))
+            await asyncio.sleep(0.05)
+            assert not staff.done()
+            # Refill one token instead of waiting three minutes for it.
+            scheduler._chat_bucket(GROUP_ID)._tokens = 1
+            scheduler._wakeup.set()
+            assert await asyncio.wait_for(staff, 1) == "staff"
+            assert sent[outbound.GROUP_CHAT_BURST:] == ["staff"]
+            assert not any(task.done() for task in relays)
+        finally:
+            await scheduler.shutdown()
+
+    asyncio.run(run())
+
+
+def test_staff_update_not_held_up_by_blocked_relay_update():
+    async def run():
+        processor = update_context.PerChatUpdateProcessor()
+        relay_blocked = asyncio.Event()
+        release = asyncio.Event()
+        finished = []
+
+        async def relay():
+            relay_blocked.set()
+            await release.wait()
+            finished.append("relay")
+
+        async def staff():
+            finished.append("staff")
+
+        relay_task = asyncio.create_task(processor.process_update(_message_update(1, 42), relay()))
+        await relay_blocked.wait()
+        await asyncio.wait_for(processor.process_update(_message_update(2, GROUP_ID), staff()), 1)
+        assert finished == ["staff"]
+        release.set()
+        await relay_task
+        assert finished == ["staff", "relay"]
+
+    asyncio.run(run())
+
+
+def test_updates_from_one_chat_run_in_order():
+    async def run():
+        processor = update_context.PerChatUpdateProcessor()
+        order = []
+
+        async def handle(label, delay):
+            await asyncio.sleep(delay)
+            order.append(label)
+
+        await asyncio.gather(
+            processor.process_update(_message_update(1, 42), handle("first", 0.05)),
+            processor.process_update(_message_update(2, 42), handle("second", 0)),
+        )
+        assert order == ["first", "second"]
+        assert not processor._chat_locks
+
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor, ContextTypes, TypeHandler
+
+import outbound
+from roles import is_admin, is_operator
+from user_details import is_banned, is_user, get_user_data
+
+MIDDLEWARE_GROUP = -1000
+MAX_CONCURRENT_UPDATES = 64
+
+
+class UpdateIdentity:
+    """Role, ban and subscription state of the user behind an update"""
+
+    __slots__ = ('user_id', 'is_admin', 'is_operator', 'is_banned', 'is_subscribed', 'user_data')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.is_admin = is_admin(user_id)
+        self.is_operator = is_operator(user_id)
+        self.is_banned = is_banned(user_id)
+        self.is_subscribed = is_user(user_id)
+        self.user_data = get_user_data(user_id)
+
+    @property
+    def has_role(self):
+        return self.is_admin or self.is_operator
+
+
+def get_identity(update: Update, context: ContextTypes.DEFAULT_TYPE = None):
+    """Returns the identity resolved for this update, resolving it on the spot if the middleware did not run"""
+    user = update.effective_user if update else None
+    if user is None:
+        return None
+
+    identity = getattr(context, 'identity', None) if context is not None else None
+    if identity is None or identity.user_id != user.id:
+        identity = UpdateIdentity(user.id)
+        if context is not None:
+            context.identity = identity
+    return identity
+
+
+async def resolve_identity(update: object, context: ContextTypes.DEFAULT_TYPE):
+    if isinstance(update, Update) and update.effective_user:
+        context.identity = UpdateIdentity(update.effective_user.id)
+        outbound.set_priority(outbound.PRIORITY_STAFF if context.identity.has_role else outbound.PRIORITY_RELAY)
+    else:
+        outbound.set_priority(outbound.PRIORITY_RELAY)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Handles updates from different chats concurrently and updates from the same chat in order.
+
+    A relay waiting on a rate-limited send then no longer holds up staff
+    replies or other users, while one user's messages are still relayed in
+    the order they were sent and a new user's topic is created only once.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+
+        entry = self._chat_locks.get(chat.id)
+        if entry is None:
+            entry = self._chat_locks[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat.id]
+
+
+def register_handlers(app):
+    app.add_handler(TypeHandler(Update, resolve_identity), group=MIDDLEWARE_GROUP)
@@ -1,13 +1,30 @@
 import os
 import json
+import sqlite3
+from types import MappingProxyType
+
+from intset import IntSet
 
 BANNED_FILE = "banned.txt"
 USERS_FILE = "users.txt"
 USER_DETAILS_FILE = "user_details.json"
+USER_DETAILS_DB_FILE = "user_details.db"
+ID_LOG_COMPACT_MIN_RECORDS = 1000
+
+STORAGE_ENGINE_JSON = "json"
+STORAGE_ENGINE_SQLITE = "sqlite"
+
+_storage_engine = STORAGE_ENGINE_SQLITE
+_db_connection = None
 
 _users_cache = None
 _banned_cache = None
 _details_cache = None
+_topic_index = {}
+_dirty = set()
+_dirty_user_ids = set()
+_pending_id_log = {"banned": [], "users": []}
+_id_log_records = {"banned": 0, "users": 0}
 _last_modified = {
     "banned": 0,
     "users": 0,
@@ -15,185 +32,391 @@ _last_modified = {
 }
 
 def load_banned(use_cache=True):
-    """Loads the list of banned users"""
+    """Loads the set of banned users (shared cache; change it via add_to_banned/remove_from_banned)"""
     global _banned_cache, _last_modified
     
-    if not os.path.exists(BANNED_FILE):
-        _banned_cache = set()
-        return set()
-    
-    file_modified = os.path.getmtime(BANNED_FILE) if os.path.exists(BANNED_FILE) else 0
-    if use_cache and _banned_cache is not None and file_modified <= _last_modified.get("banned", 0):
-        return _banned_cache.copy()
+    if use_cache and _banned_cache is not None:
+        return _banned_cache
     
-    try:
-        with open(BANNED_FILE, "r", encoding="utf-8") as f:
-            banned_set = set(line.strip() for line in f if line.strip())
-            _banned_cache = banned_set
-            _last_modified["banned"] = file_modified
-            return banned_set
-    except FileNotFoundError:
-        _banned_cache = set()
-        return set()
+    _banned_cache = _read_id_log("banned", BANNED_FILE)
+    _last_modified["banned"] = _file_mtime(BANNED_FILE)
+    return _banned_cache
 
 def save_banned(banned_set):
-    """Saves the list of banned users"""
-    global _banned_cache, _last_modified
+    """Saves the set of banned users (written to disk on the next flush)"""
+    global _banned_cache
     
+    _banned_cache = banned_set if isinstance(banned_set, IntSet) else IntSet(banned_set)
+    _dirty.add("banned")
+    _pending_id_log["banned"] = []
+
+def _read_id_log(store, path):
+    """Replays an id log where a bare id adds a user and "-id" removes it"""
+    ids = set()
+    records = 0
     try:
-        with open(BANNED_FILE, "w", encoding="utf-8") as f:
-            for user_id in banned_set:
-                f.write(str(user_id) + "\n")
-        
-        _banned_cache = banned_set.copy()
-        _last_modified["banned"] = os.path.getmtime(BANNED_FILE)
-    except Exception:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                records += 1
+                try:
+                    if line.startswith("-"):
+                        ids.discard(int(line[1:]))
+                    else:
+                        ids.add(int(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
         pass
+    _id_log_records[store] = records
+    return IntSet(ids)
+
+def _file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
 
 def add_to_banned(user_id):
     """Adds a user to the banned list"""
-    banned_set = load_banned()
-    user_id_str = str(user_id)
-    if user_id_str not in banned_set:
-        banned_set.add(user_id_str)
-        save_banned(banned_set)
+    if load_banned().add(user_id):
+        _pending_id_log["banned"].append(str(int(user_id)))
         return True
     return False
 
 def remove_from_banned(user_id):
     """Removes a user from the banned list"""
-    banned_set = load_banned()
-    user_id_str = str(user_id)
-    if user_id_str in banned_set:
-        banned_set.remove(user_id_str)
-        save_banned(banned_set)
+    if load_banned().discard(user_id):
+        _pending_id_log["banned"].append(f"-{int(user_id)}")
         return True
     return False
 
 def is_banned(user_id):
     """Checks if a user is banned"""
-    banned_set = load_banned()
-    return str(user_id) in banned_set
+    return user_id in load_banned()
 
 def load_users(use_cache=True):
-    """Loads the list of users for messaging"""
+    """Loads the set of users for messaging (shared cache; change it via add_to_users/remove_from_users)"""
     global _users_cache, _last_modified
     
-    if not os.path.exists(USERS_FILE):
-        _users_cache = set()
-        return set()
+    if use_cache and _users_cache is not None:
+        return _users_cache
     
-    file_modified = os.path.getmtime(USERS_FILE) if os.path.exists(USERS_FILE) else 0
-    if use_cache and _users_cache is not None and file_modified <= _last_modified.get("users", 0):
-        return _users_cache.copy()
-    
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            users_set = set(line.strip() for line in f if line.strip())
-            _users_cache = users_set
-            _last_modified["users"] = file_modified
-            return users_set
-    except FileNotFoundError:
-        _users_cache = set()
-        return set()
+    _users_cache = _read_id_log("users", USERS_FILE)
+    _last_modified["users"] = _file_mtime(USERS_FILE)
+    return _users_cache
 
 def save_users(users_set):
-    """Saves the list of users for messaging"""
-    global _users_cache, _last_modified
+    """Saves the set of users for messaging (written to disk on the next flush)"""
+    global _users_cache
     
-    try:
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            for user_id in users_set:
-                f.write(str(user_id) + "\n")
-        
-        _users_cache = users_set.copy()
-        _last_modified["users"] = os.path.getmtime(USERS_FILE)
-    except Exception:
-        pass
+    _users_cache = users_set if isinstance(users_set, IntSet) else IntSet(users_set)
+    _dirty.add("users")
+    _pending_id_log["users"] = []
 
 def add_to_users(user_id):
     """Adds a user to the messaging list"""
-    users_set = load_users()
-    user_id_str = str(user_id)
-    if user_id_str not in users_set:
-        users_set.add(user_id_str)
-        save_users(users_set)
+    if load_users().add(user_id):
+        _pending_id_log["users"].append(str(int(user_id)))
         return True
     return False
 
 def remove_from_users(user_id):
     """Removes a user from the messaging list"""
-    users_set = load_users()
-    user_id_str = str(user_id)
-    if user_id_str in users_set:
-        users_set.remove(user_id_str)
-        save_users(users_set)
+    if load_users().discard(user_id):
+        _pending_id_log["users"].append(f"-{int(user_id)}")
         return True
     return False
 
+def remove_many_from_users(user_ids):
+    """Removes several users from the messaging list with one compacting write"""
+    removed = load_users().difference_update(user_ids)
+    if removed:
+        _dirty.add("users")
+        _pending_id_log["users"] = []
+    return removed
+
 def is_user(user_id):
     """Checks if a user is subscribed to messaging"""
-    users_set = load_users()
-    return str(user_id) in users_set
+    return user_id in load_users()
 
-def load_user_details(use_cache=True):
-    """Loads user details"""
-    global _details_cache, _last_modified
+def set_storage_engine(engine_name):
+    """Selects the storage engine for user details ("sqlite" or "json")"""
+    global _storage_engine, _details_cache
+    
+    engine_name = (engine_name or STORAGE_ENGINE_SQLITE).strip().lower()
+    if engine_name not in (STORAGE_ENGINE_JSON, STORAGE_ENGINE_SQLITE):
+        engine_name = STORAGE_ENGINE_SQLITE
+    
+    if engine_name != _storage_engine:
+        _storage_engine = engine_name
+        _details_cache = None
+    return _storage_engine
+
+def _get_db():
+    """Opens the user details database, creating and migrating it on first use"""
+    global _db_connection
+    
+    if _db_connection is not None:
+        return _db_connection
+    
+    connection = sqlite3.connect(USER_DETAILS_DB_FILE, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS user_details (user_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+    connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    connection.commit()
+    _db_connection = connection
+    _migrate_json_to_db(connection)
+    return connection
+
+def _migrate_json_to_db(connection):
+    """Imports user_details.json into the database once"""
+    if connection.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+        return
     
-    if not os.path.exists(USER_DETAILS_FILE):
-        _details_cache = {}
-        return {}
+    details = {}
+    if os.path.exists(USER_DETAILS_FILE):
+        try:
+            with open(USER_DETAILS_FILE, "r", encoding="utf-8") as f:
+                details = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Error: Could not read {USER_DETAILS_FILE}, will retry the migration on next start. Details: {e}")
+            return
+    
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO user_details (user_id, data) VALUES (?, ?)",
+            ((str(user_id), json.dumps(data, ensure_ascii=False)) for user_id, data in details.items())
+        )
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')")
+
+def _db_write_rows(rows, replace_all=False):
+    """Writes (user_id, serialized data or None) rows in a single transaction"""
+    connection = _get_db()
+    with connection:
+        if replace_all:
+            connection.execute("DELETE FROM user_details")
+        connection.executemany(
+            "DELETE FROM user_details WHERE user_id = ?",
+            [(user_id_str,) for user_id_str, data in rows if data is None]
+        )
+        connection.executemany(
+            "INSERT INTO user_details (user_id, data) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+            [(user_id_str, data) for user_id_str, data in rows if data is not None]
+        )
+
+def _load_details_cache(use_cache=True):
+    """Returns the cached user details map, reloading it from storage when needed"""
+    if _storage_engine == STORAGE_ENGINE_SQLITE:
+        if not use_cache or _details_cache is None:
+            details = {}
+            try:
+                for user_id_str, data in _get_db().execute("SELECT user_id, data FROM user_details"):
+                    details[user_id_str] = json.loads(data)
+            except (sqlite3.Error, json.JSONDecodeError):
+                details = {}
+            _set_details_cache(details)
+        return _details_cache
     
-    file_modified = os.path.getmtime(USER_DETAILS_FILE) if os.path.exists(USER_DETAILS_FILE) else 0
-    if use_cache and _details_cache is not None and file_modified <= _last_modified.get("details", 0):
-        return _details_cache.copy()
+    if use_cache and _details_cache is not None:
+        return _details_cache
     
     try:
         with open(USER_DETAILS_FILE, "r", encoding="utf-8") as f:
             details = json.load(f)
             details = {str(k): v for k, v in details.items()}
-            _details_cache = details
-            _last_modified["details"] = file_modified
-            return details
+            _set_details_cache(details)
     except json.JSONDecodeError:
-        _details_cache = {}
-        return {}
+        _set_details_cache({})
     except FileNotFoundError:
-        _details_cache = {}
-        return {}
+        _set_details_cache({})
+    _last_modified["details"] = _file_mtime(USER_DETAILS_FILE)
+    return _details_cache
+
+def _set_details_cache(details):
+    """Replaces the details cache and rebuilds the topic index from it"""
+    global _details_cache, _topic_index
+    
+    _details_cache = details
+    _topic_index = {}
+    for user_id_str, data in details.items():
+        topic_id = data.get("topic_id_in_group") if isinstance(data, dict) else None
+        if topic_id is not None:
+            _topic_index[topic_id] = user_id_str
+
+def _reindex_user_topic(user_id_str, old_topic_id, new_topic_id):
+    """Keeps the topic index in sync after a user's topic_id_in_group changed"""
+    if old_topic_id == new_topic_id:
+        return
+    if old_topic_id is not None and _topic_index.get(old_topic_id) == user_id_str:
+        del _topic_index[old_topic_id]
+    if new_topic_id is not None:
+        _topic_index[new_topic_id] = user_id_str
+
+def load_user_details(use_cache=True):
+    """Loads user details"""
+    return _load_details_cache(use_cache).copy()
 
 def save_user_details(details):
-    """Saves user details"""
-    global _details_cache, _last_modified
+    """Saves user details (written to disk on the next flush)"""
+    _set_details_cache({str(user_id): data for user_id, data in details.items()})
+    _dirty.add("details")
+    _dirty_user_ids.clear()
+
+def _save_user_record(user_id_str, details):
+    """Marks a single user's record as changed in the cache"""
+    if _storage_engine == STORAGE_ENGINE_SQLITE:
+        _dirty_user_ids.add(user_id_str)
+    else:
+        _dirty.add("details")
+
+def _format_id_lines(id_set):
+    return "".join(str(user_id) + "\n" for user_id in id_set)
+
+def _serialize_rows(user_ids):
+    details = _details_cache or {}
+    rows = []
+    for user_id_str in user_ids:
+        data = details.get(user_id_str)
+        rows.append((user_id_str, json.dumps(data, ensure_ascii=False) if data is not None else None))
+    return rows
+
+def _atomic_write(path, text):
+    """Writes a file through a temporary file so readers never see a partial write"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+def _append_to_file(path, text):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+def has_pending_writes():
+    """Checks if any store has changes that are not on disk yet"""
+    return bool(_dirty or _dirty_user_ids or _pending_id_log["banned"] or _pending_id_log["users"])
+
+def _has_unsaved_changes(store):
+    return store in _dirty or bool(_pending_id_log.get(store))
+
+def collect_pending_writes():
+    """Snapshots the dirty stores into write jobs and clears their dirty flags"""
+    jobs = []
+    for store, id_set in (("banned", _banned_cache), ("users", _users_cache)):
+        records = _pending_id_log[store]
+        if store not in _dirty and not records:
+            continue
+        id_count = len(id_set) if id_set is not None else 0
+        compact_limit = max(ID_LOG_COMPACT_MIN_RECORDS, 2 * id_count)
+        if store in _dirty or _id_log_records[store] + len(records) > compact_limit:
+            jobs.append((store, _format_id_lines(id_set or ())))
+            _id_log_records[store] = id_count
+        else:
+            jobs.append((store + "_log", "".join(record + "\n" for record in records)))
+            _id_log_records[store] += len(records)
+        _pending_id_log[store] = []
+    if _storage_engine == STORAGE_ENGINE_SQLITE:
+        if "details" in _dirty:
+            jobs.append(("details_db_all", _serialize_rows(list(_details_cache or ()))))
+        elif _dirty_user_ids:
+            jobs.append(("details_db", _serialize_rows(_dirty_user_ids)))
+    elif "details" in _dirty:
+        jobs.append(("details", json.dumps(_details_cache or {}, ensure_ascii=False, indent=2)))
     
-    try:
-        with open(USER_DETAILS_FILE, "w", encoding="utf-8") as f:
-            json.dump(details, f, ensure_ascii=False, indent=2)
-        
-        _details_cache = details.copy()
-        _last_modified["details"] = os.path.getmtime(USER_DETAILS_FILE)
-    except Exception:
-        pass
+    _dirty.clear()
+    _dirty_user_ids.clear()
+    return jobs
+
+def write_pending_writes(jobs):
+    """Writes collected jobs to disk and returns the failed ones; safe to run in a worker thread"""
+    failed = []
+    for job in jobs:
+        store, payload = job
+        try:
+            if store == "banned":
+                _atomic_write(BANNED_FILE, payload)
+                _last_modified["banned"] = os.path.getmtime(BANNED_FILE)
+            elif store == "users":
+                _atomic_write(USERS_FILE, payload)
+                _last_modified["users"] = os.path.getmtime(USERS_FILE)
+            elif store == "banned_log":
+                _append_to_file(BANNED_FILE, payload)
+                _last_modified["banned"] = os.path.getmtime(BANNED_FILE)
+            elif store == "users_log":
+                _append_to_file(USERS_FILE, payload)
+                _last_modified["users"] = os.path.getmtime(USERS_FILE)
+            elif store == "details":
+                _atomic_write(USER_DETAILS_FILE, payload)
+                _last_modified["details"] = os.path.getmtime(USER_DETAILS_FILE)
+            else:
+                _db_write_rows(payload, replace_all=store == "details_db_all")
+        except (OSError, sqlite3.Error):
+            failed.append(job)
+    return failed
+
+def requeue_pending_writes(failed_jobs):
+    """Marks the stores of failed jobs dirty again so the next flush retries them"""
+    for store, payload in failed_jobs:
+        if store == "details_db":
+            _dirty_user_ids.update(user_id_str for user_id_str, data in payload)
+        elif store in ("details", "details_db_all"):
+            _dirty.add("details")
+        elif store in ("banned_log", "users_log"):
+            _dirty.add(store[:-len("_log")])
+        else:
+            _dirty.add(store)
+
+def get_externally_modified_stores():
+    """Returns the stores whose files were changed by another process since the last load or write"""
+    watched = [("banned", BANNED_FILE), ("users", USERS_FILE)]
+    if _storage_engine == STORAGE_ENGINE_JSON:
+        watched.append(("details", USER_DETAILS_FILE))
+    
+    return [
+        store for store, path in watched
+        if not _has_unsaved_changes(store) and _file_mtime(path) != _last_modified.get(store, 0)
+    ]
+
+def reload_stores(stores):
+    """Drops the cached copies of the given stores and reads them from disk again"""
+    if "banned" in stores and not _has_unsaved_changes("banned"):
+        load_banned(use_cache=False)
+    if "users" in stores and not _has_unsaved_changes("users"):
+        load_users(use_cache=False)
+    if "details" in stores and not _has_unsaved_changes("details"):
+        _load_details_cache(use_cache=False)
+
+def flush_pending_writes():
+    """Synchronously writes every dirty store to disk"""
+    failed = write_pending_writes(collect_pending_writes())
+    requeue_pending_writes(failed)
+    return not failed
 
 def get_user_data(user_id):
-    """Gets data for a specific user"""
-    details = load_user_details()
-    return details.get(str(user_id))
+    """Gets a read-only view of the data for a specific user"""
+    user_data = _load_details_cache().get(str(user_id))
+    return MappingProxyType(user_data) if user_data is not None else None
 
 def update_user_data(user_id, data_dict):
     """Updates or adds user data"""
-    details = load_user_details()
+    details = _load_details_cache()
     user_id_str = str(user_id)
     if user_id_str not in details:
         details[user_id_str] = {}
     
+    old_topic_id = details[user_id_str].get("topic_id_in_group")
     details[user_id_str].update(data_dict)
-    save_user_details(details)
+    _save_user_record(user_id_str, details)
+    _reindex_user_topic(user_id_str, old_topic_id, details[user_id_str].get("topic_id_in_group"))
     return True
 
 def update_user_data_field(user_id, field, value, delete_if_none=False):
     """Updates a specific field in user data"""
-    details = load_user_details()
+    details = _load_details_cache()
     user_id_str = str(user_id)
     
     if user_id_str not in details:
@@ -201,6 +424,8 @@ def update_user_data_field(user_id, field, value, delete_if_none=False):
             return
         details[user_id_str] = {}
     
+    old_topic_id = details[user_id_str].get("topic_id_in_group")
+    
     if value is None and delete_if_none:
         if field in details[user_id_str]:
             del details[user_id_str][field]
@@ -209,21 +434,20 @@ def update_user_data_field(user_id, field, value, delete_if_none=False):
     else:
         details[user_id_str][field] = value
     
-    save_user_details(details)
+    _save_user_record(user_id_str, details)
+    _reindex_user_topic(user_id_str, old_topic_id, details.get(user_id_str, {}).get("topic_id_in_group"))
     return True
 
 def get_user_id_by_topic_id(topic_id, group_id_config_str=None):
     """Finds user ID by topic ID in the group"""
-    details = load_user_details()
+    _load_details_cache()
     try:
         topic_id_int = int(topic_id)
-    except ValueError:
+    except (TypeError, ValueError):
         return None
 
-    for user_id_str_key, data in details.items():
-        if data.get("topic_id_in_group") == topic_id_int:
-            return str(user_id_str_key)
-    return None
+    user_id_str = _topic_index.get(topic_id_int)
+    return str(user_id_str) if user_id_str is not None else None
 
 def get_user_info_string(user_id_str, bot_user_data_all=None, effective_user_obj=None):
     """Formats a string with user information"""
@@ -324,12 +548,10 @@ def get_user_info_string(user_id_str, bot_user_data_all=None, effective_user_obj
             hide_status = "Enabled" if user_specific_data.get("hide_delivery_notifications") else "Disabled"
             info_lines.append(f"🔕 Notifications Hidden: {hide_status}")
             
-    banned_users = load_banned()
-    if user_id_str in banned_users:
+    if is_banned(user_id_str):
         info_lines.append(f"⛔ Status: BANNED")
         
-    users_list = load_users()
-    if user_id_str in users_list:
+    if is_user(user_id_str):
         info_lines.append(f"📬 Subscribed to mailings: Yes")
     else:
         info_lines.append(f"📭 Subscribed to mailings: No")